@@ -165,11 +165,11 @@ def generate_message2(guild_id: int, users: Optional[List[int]] = None,
                       word_limit: Optional[LimitTuple] = None,
                       blueprint: Optional[str] = None) -> Optional[str]:
     if not blueprint:
-        random_msg = random_message(guild_id, users, channel,
-                                    word_limit=word_limit, count=1,
-                                    content=True).fetchone()
-        if random_message:
-            blueprint = random_msg.content
+        random_msgs = random_message(guild_id, users, channel,
+                                     word_limit=word_limit, count=1,
+                                     content=True)
+        if random_msgs:
+            blueprint = random_msgs[0].content
         else:
             return None
 
@@ -36,16 +36,16 @@ def message_stats(guild_id: int,
                   channels: Optional[List[int]] = None,
                   case_sensitive: bool = False,
                   plot: bool = False) -> Union[MessageStats, BytesIO]:
-    cur = message_stats_db(guild_id, pattern, users, channels,
-                           case_sensitive=case_sensitive,
-                           plot=plot)
+    rows = message_stats_db(guild_id, pattern, users, channels,
+                            case_sensitive=case_sensitive,
+                            plot=plot)
     if not plot:
         stats = MessageStats()
-        for name, count in cur:
+        for name, count in rows:
             stats.add(name, count)
         return stats
     else:
         data = CountPlotData()
-        for id_, name, date, count in cur:
+        for id_, name, date, count in rows:
             data.add(id_, name, date, count)
         return plot_counts(data, pattern)
@@ -36,9 +36,9 @@ def random_message(guild_id: int,
                    count: int = 1,
                    content: bool = False,
                    images: bool = False):
-    cur = random_message_db(guild_id, users, channel, word_limit, count,
-                            content, images)
-    for msg_id, channel_id, username, timestamp, content, images in cur:
+    rows = random_message_db(guild_id, users, channel, word_limit, count,
+                             content, images)
+    for msg_id, channel_id, username, timestamp, content, images in rows:
         yield DatabaseMessage(guild_id, msg_id, Channel(id=channel_id),
                               User(name=username),
                               timestamp, content,
@@ -3,6 +3,8 @@ from collections import deque, defaultdict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import discord
+from functools import partial
+from itertools import islice
 import logging
 from pathlib import Path
 import random
@@ -28,6 +30,52 @@ REPEAT_EMOJI = '🔂'
 BotCommandType = Callable[..., Awaitable[bool]]
 logger = logging.getLogger(__name__)
 
+ALREADY_TRACER_RE = re.compile(r"(?:i(?:m|'m| am|d|'d| would)? ?"
+                               "(?:wanna|want to|going to|gonna|like to) "
+                               # "be|(?:what|how) about) (.+)",
+                               "be) (.+)",
+                               flags=re.I)
+CEE_LO_RE = re.compile(r'(?:cee ?lo|get (?:your|ur) ass back here)',
+                       flags=re.I)
+# Meme triggers are merged into one alternation per meme so each message is
+# only scanned once. Group names are the audio file names.
+DOUNDRISSIT_RE = re.compile(
+    r'(?P<schlow_down>sc?hlow down)'
+    r'|(?P<rawky>rawky)'
+    r'|(?P<doundrissit>slide down|doundrissit)'
+    r'|(?P<chooses_combat_gear>chooses combat gear)'
+    r'|(?P<walnum_bolt>w[ao]lnum bolt?)'
+    r'|(?P<mother_of_god>mother of god)'
+    r'|(?P<mulled_good_baby>mulled good)'
+    r'|(?P<nilly_heeya>nill[yi] heeyah?)'
+    r'|(?P<youorai>youorai|are you (?:alright|all right))'
+)
+COROLLA_RE = re.compile(
+    r'(?P<a_to_b>a to b)'
+    r'|(?P<be_that_guy>be that guy)'
+    r'|(?P<coffee_to_strangers>coffee to strangers)'
+    r'|(?P<i_wrote_that_book>i wrote that book)'
+    r'|(?P<my_dad>my dad)'
+    r'|(?P<used_to_have_a_corolla>used to have a corolla)'
+    r'|(?P<yes_i_know_that>yes,? i know that)'
+    r'|(?P<you_got_here_first>you got here first)'
+)
+DOUNDRISSIT_FILES = {name: Path('doundrissit', f'{name}.wav')
+                     for name in DOUNDRISSIT_RE.groupindex}
+COROLLA_FILES = {name: Path('corolla', f'{name}.wav')
+                 for name in COROLLA_RE.groupindex}
+# Messages that play a sound when they're sent on their own (case-insensitive)
+EXACT_MATCH_AUDIO = {
+    'sans': 'sans.wav',
+    'v': 'vsauce.wav',
+    'but i love chef': 'but_i_love_chef.wav',
+    'sayori': 'd.wav',
+    'sayonara': 'd.wav',
+    'door': 'd.wav',
+    'ew': 'EW_DUDE_WTF.wav',
+    'crickets': 'crickets.wav',
+}
+
 
 class TempNickname:
 
@@ -79,7 +127,7 @@ def repeatable(f: BotCommandType):
                           cmd: ParsedCommand, *args, **kwargs):
         result = await f(self, msg=msg, cmd=cmd, *args, **kwargs)
         if result:
-            memory = self.channel_memory[msg.channel]
+            memory = self.channel_memory[msg.channel.id]
             if memory['last_command']:
                 # Remove the repeat reaction (if it exists)
                 # This is usually removed in the client listener,
@@ -98,7 +146,9 @@ def repeatable(f: BotCommandType):
             if isinstance(result, discord.Message):
                 await result.add_reaction(REPEAT_EMOJI)
 
-            cmd = LastCommand(msg=msg, cmd=cmd, function=repeatable(f),
+            # Store this wrapper (not a fresh one) so replays don't stack
+            # another layer of wrapping each time
+            cmd = LastCommand(msg=msg, cmd=cmd, function=_repeatable,
                               args=args, kwargs=kwargs)
             memory['last_command'] = (cmd, result)
         return result
@@ -112,10 +162,33 @@ class Hawkbot(discord.Client):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.channel_memory: Dict[str, any] = \
+        self.channel_memory: Dict[int, Any] = \
             defaultdict(self._channel_memory_factory)
         self.prefixes = PrefixStore(default=self.default_prefix)
         self.parser = Parser()
+        # Handlers keyed by command name, called with `msg` and `cmd` kwargs
+        self._admin_commands: Dict[str, BotCommandType] = {
+            'admin init guild': lambda msg, cmd: self.init_guild(msg=msg),
+            'admin download': self.download_messages,
+            'admin chain': lambda msg, cmd: self.create_chain(msg=msg),
+        }
+        # Handlers keyed by command root (or full name for subcommands)
+        self._commands: Dict[str, BotCommandType] = {
+            'ping': lambda msg, cmd: self.ping(msg=msg),
+            'help': self.help,
+            'config': self.config,
+            'again': lambda msg, cmd: self.again(msg=msg),
+            'cleanse': lambda msg, cmd: self.cleanse(msg=msg),
+            'quote': self.quote_link,
+            'gdrive': self.gdrive_direct_link,
+            'portal': self.channel_portal,
+            'vibe check': lambda msg, cmd: self.vibe_check(msg=msg),
+            'generate': self.generate_message,
+            'rquote': self.random_quote,
+            'rimage': self.random_image,
+            'mstats': self.message_stats,
+            'hawktober': lambda msg, cmd: self.send_hawktober(),
+        }
 
     @staticmethod
     def _channel_memory_factory():
@@ -140,6 +213,9 @@ class Hawkbot(discord.Client):
 
     async def on_ready(self):
         logger.info('Hawkbot client started')
+        # Also called after reconnecting, when guilds and members have been
+        # rebuilt
+        dc_utils.invalidate_all()
         asyncio.run_coroutine_threadsafe(self.hawktober_scheduler(), self.loop)
 
     async def on_message(self, msg):
@@ -151,7 +227,6 @@ class Hawkbot(discord.Client):
         try:
             if await self.commands(msg):
                 return
-            await asyncio.sleep(1.0)
             await self.ranked_trio_memes(msg)
         except UserFeedbackError as e:
             await send_error(msg.channel, e)
@@ -181,6 +256,15 @@ class Hawkbot(discord.Client):
         if await self.unpin_msg(payload):
             return
 
+    async def on_guild_available(self, guild):
+        dc_utils.invalidate_guild(guild.id)
+
+    async def on_member_join(self, member):
+        dc_utils.invalidate_guild(member.guild.id)
+
+    async def on_member_remove(self, member):
+        dc_utils.invalidate_guild(member.guild.id)
+
     async def commands(self, msg):
         prefix = self.prefixes[msg.guild.id]
         if not msg.content.startswith(prefix):
@@ -193,44 +277,22 @@ class Hawkbot(discord.Client):
         root = cmd.base.root
         name = cmd.base.name
 
-        if root == 'admin' and msg.author.id == config['owner_id']:
-            if name == 'admin init guild':
-                await self.init_guild(msg=msg)
-            elif name == 'admin download':
-                await self.download_messages(msg=msg, cmd=cmd)
-            elif name == 'admin chain':
-                await self.create_chain(msg=msg)
-        elif root == 'ping':
-            await self.ping(msg=msg)
-        elif root == 'help':
-            await self.help(msg=msg, cmd=cmd)
-        elif root == 'config':
-            await self.config(msg=msg, cmd=cmd)
-        elif root == 'again':
-            await self.again(msg=msg)
-        elif root == 'cleanse':
-            await self.cleanse(msg=msg)
-        elif root == 'quote':
-            await self.quote_link(msg=msg, cmd=cmd)
-        elif root == 'gdrive':
-            await self.gdrive_direct_link(msg=msg, cmd=cmd)
-        elif root == 'portal':
-            await self.channel_portal(msg=msg, cmd=cmd)
-        elif name == 'vibe check':
-            await self.vibe_check(msg=msg)
-        elif root == 'generate':
-            await self.generate_message(msg=msg, cmd=cmd)
-        elif root == 'rquote':
-            await self.random_quote(msg=msg, cmd=cmd)
-        elif root == 'rimage':
-            await self.random_image(msg=msg, cmd=cmd)
-        elif root == 'mstats':
-            await self.message_stats(msg=msg, cmd=cmd)
-        elif root == 'hawktober':
-            await self.send_hawktober()
+        if root == 'admin':
+            if msg.author.id != config['owner_id']:
+                return True
+            handler = self._admin_commands.get(name)
+        else:
+            handler = self._commands.get(root) or self._commands.get(name)
+        if handler:
+            await handler(msg=msg, cmd=cmd)
         return True
 
     async def ranked_trio_memes(self, msg):
+        if msg.author.bot:
+            return
+        if msg.content.startswith(self.prefixes[msg.guild.id]):
+            # Unrecognized command
+            return
         if msg.guild.id not in {288545683462553610, 150236153910394881,
                                 324981224110030848, 589381124325900291,
                                 612501390681702432}:
@@ -243,12 +305,10 @@ class Hawkbot(discord.Client):
         await self.doundrissit(msg)
         await self.corolla(msg)
         await self.and_i_oop(msg)
-        await self.sans(msg)
-        await self.vsauce(msg)
-        await self.but_i_love_chef(msg)
-        await self.sayori(msg)
-        await self.ew(msg)
-        await self.crickets(msg)
+
+        audio_file = EXACT_MATCH_AUDIO.get(msg.content.lower())
+        if audio_file:
+            await play_audio_file(msg, audio_file)
 
     @staticmethod
     def create_help_embed(command_name: str,
@@ -312,7 +372,7 @@ class Hawkbot(discord.Client):
             return False
 
         chan = reaction.message.channel
-        last_command = self.channel_memory[chan]['last_command']
+        last_command = self.channel_memory[chan.id]['last_command']
         if not last_command:
             return False
 
@@ -389,7 +449,8 @@ class Hawkbot(discord.Client):
 
             if action is None:
                 # Get
-                pins_channel = db.config.get_pins_channel(guild.id)
+                pins_channel = await self.loop.run_in_executor(
+                    None, db.config.get_pins_channel, guild.id)
                 pins_channel_name = 'None'
                 if pins_channel:
                     pins_channel_name = \
@@ -398,11 +459,13 @@ class Hawkbot(discord.Client):
                                            pins_channel_name)
 
             elif action == 'set':
-                db.config.set_pins_channel(guild.id, chan.id)
+                await self.loop.run_in_executor(
+                    None, db.config.set_pins_channel, guild.id, chan.id)
                 await self.send_config_msg(chan, 'Pins channel set')
 
             elif action == 'remove':
-                db.config.set_pins_channel(guild.id, None)
+                await self.loop.run_in_executor(
+                    None, db.config.set_pins_channel, guild.id, None)
                 await self.send_config_msg(chan, 'Pins channel removed')
 
         elif subcommand == 'prefix':
@@ -432,7 +495,8 @@ class Hawkbot(discord.Client):
 
             if action is None:
                 # Get
-                channel_ids = db.config.get_channel_download_blacklist(guild.id)
+                channel_ids = await self.loop.run_in_executor(
+                    None, db.config.get_channel_download_blacklist, guild.id)
                 channel_names = []
                 # noinspection PyShadowingBuiltins
                 for id in channel_ids:
@@ -444,21 +508,24 @@ class Hawkbot(discord.Client):
                                            channel_names)
 
             elif action == 'add':
-                db.config.add_channel_to_download_blacklist(guild.id, chan.id)
+                await self.loop.run_in_executor(
+                    None, db.config.add_channel_to_download_blacklist,
+                    guild.id, chan.id)
                 await self.send_config_msg(chan,
                                            'Added this channel to the '
                                            'download blacklist')
 
             elif action == 'remove':
-                db.config.remove_channel_from_download_blacklist(guild.id,
-                                                                 chan.id)
+                await self.loop.run_in_executor(
+                    None, db.config.remove_channel_from_download_blacklist,
+                    guild.id, chan.id)
                 await self.send_config_msg(chan,
                                            'Removed this channel to the '
                                            'download blacklist')
 
     async def again(self, msg):
         chan = msg.channel
-        last_cmd: LastCommand = self.channel_memory[chan]['last_command'][0]
+        last_cmd: LastCommand = self.channel_memory[chan.id]['last_command'][0]
         if not last_cmd:
             return False
         result = await last_cmd.function(self, msg=last_cmd.msg,
@@ -546,7 +613,7 @@ class Hawkbot(discord.Client):
         await chan.send(commands.vibe_check())
 
     async def init_guild(self, msg: discord.Message):
-        db.main.init_guild(msg.guild)
+        await self.loop.run_in_executor(None, db.main.init_guild, msg.guild)
 
     async def download_messages(self, msg: discord.Message, cmd: ParsedCommand):
         chan = msg.channel
@@ -673,11 +740,14 @@ class Hawkbot(discord.Client):
         for i in range(count):
             this_iter = []
             for blueprint in blueprints:
-                generation = generation_function(
-                    msg.guild.id,
-                    users=user_ids,
-                    channel=channel_id,
-                    blueprint=blueprint, word_limit=(limit_min, limit_max)
+                generation = await self.loop.run_in_executor(
+                    None, partial(
+                        generation_function,
+                        msg.guild.id,
+                        users=user_ids,
+                        channel=channel_id,
+                        blueprint=blueprint, word_limit=(limit_min, limit_max)
+                    )
                 )
                 this_iter.append(generation)
             final_msgs.append('\n\n'.join(this_iter))
@@ -688,7 +758,7 @@ class Hawkbot(discord.Client):
         gen_msg = await chan.send(embed=embed)
 
         # AI generated image for content
-        # image = gan_image(final_msg)
+        # image = await gan_image(final_msg)
         # if image:
         #     await chan.send(file=discord.File(image, 'rquote.jpg'))
 
@@ -716,11 +786,15 @@ class Hawkbot(discord.Client):
         limit_max = cast(LimitParam, cmd.limit).max
         count = cast(CountParam, cmd.count).count
 
+        random_msgs = await self.loop.run_in_executor(
+            None, lambda: list(commands.random_message(
+                msg.guild.id, users=user_ids, channel=channel_id,
+                word_limit=(limit_min, limit_max), count=count, content=True
+            ))
+        )
+
         sent_msg = None
-        for msg in commands.random_message(msg.guild.id, users=user_ids,
-                                           channel=channel_id,
-                                           word_limit=(limit_min, limit_max),
-                                           count=count, content=True):
+        for msg in random_msgs:
             embed = discord.Embed(description=msg.content,
                                   title=msg.author.name,
                                   timestamp=msg.created_at,
@@ -730,14 +804,14 @@ class Hawkbot(discord.Client):
                 sent_msg = await chan.send(embed=embed)
                 await sent_msg.add_reaction('❔')
 
-                rquote_memory = self.channel_memory[chan]['rquote']
+                rquote_memory = self.channel_memory[chan.id]['rquote']
                 rquote_memory[sent_msg.id] = msg
             else:
                 embed.description += f'\n[[Context]]({msg.jump_url})'
                 sent_msg = await chan.send(embed=embed)
 
             # AI generated image for content
-            # image = gan_image(msg.content)
+            # image = await gan_image(msg.content)
             # if image:
             #     await chan.send(file=discord.File(image, 'rquote.jpg'))
 
@@ -747,7 +821,7 @@ class Hawkbot(discord.Client):
     async def random_quote_reveal(self, reaction, user):
         msg = reaction.message
         chan = msg.channel
-        mem = self.channel_memory[chan]['rquote']
+        mem = self.channel_memory[chan.id]['rquote']
         if msg.id not in mem:
             return False
         if reaction.emoji != '❔':
@@ -779,10 +853,15 @@ class Hawkbot(discord.Client):
 
         count = cast(CountParam, cmd.count).count
 
+        random_msgs = await self.loop.run_in_executor(
+            None, lambda: list(commands.random_message(
+                msg.guild.id, users=user_ids, channel=channel_id, count=count,
+                images=True
+            ))
+        )
+
         sent_msg = None
-        for msg in commands.random_message(msg.guild.id, users=user_ids,
-                                           channel=channel_id, count=count,
-                                           images=True):
+        for msg in random_msgs:
             embed = discord.Embed(title=msg.author.name,
                                   description=f'\n[[Context]]({msg.jump_url})',
                                   timestamp=msg.created_at,
@@ -821,9 +900,13 @@ class Hawkbot(discord.Client):
             search_pattern = rf'\b{search_pattern}\b'
 
         # Execute
-        stats = commands.message_stats(
-            msg.guild.id, search_pattern, users=user_ids,
-            channels=channel_ids, case_sensitive=case_sensitive, plot=plot)
+        stats = await self.loop.run_in_executor(
+            None, partial(
+                commands.message_stats,
+                msg.guild.id, search_pattern, users=user_ids,
+                channels=channel_ids, case_sensitive=case_sensitive, plot=plot
+            )
+        )
 
         if not plot:
             title = 'Stats for {}'.format(f'regex pattern /{pattern.value}/'
@@ -845,10 +928,12 @@ class Hawkbot(discord.Client):
         pinner = await self.fetch_user(payload.user_id)
         orig_msg: discord.Message = await chan.fetch_message(payload.message_id)
 
-        if db.pins.get_pin_msg_id(orig_msg.guild.id, orig_msg.id):
+        if await self.loop.run_in_executor(None, db.pins.get_pin_msg_id,
+                                           orig_msg.guild.id, orig_msg.id):
             return True
 
-        pins_channel = db.config.get_pins_channel(orig_msg.guild.id)
+        pins_channel = await self.loop.run_in_executor(
+            None, db.config.get_pins_channel, orig_msg.guild.id)
         if pins_channel is None:
             await send_error(orig_msg.channel, ErrorStrings.no_pins_channel)
             return True
@@ -866,7 +951,9 @@ class Hawkbot(discord.Client):
         except discord.HTTPException as e:
             await send_error(orig_msg.channel, e)
         else:
-            db.pins.pin_message(guild.id, orig_msg.id, pinned_msg.id)
+            await self.loop.run_in_executor(None, db.pins.pin_message,
+                                            guild.id, orig_msg.id,
+                                            pinned_msg.id)
 
         return True
 
@@ -878,11 +965,13 @@ class Hawkbot(discord.Client):
         guild: discord.Guild = chan.guild
         orig_msg: discord.Message = await chan.fetch_message(payload.message_id)
 
-        pinned_msg_id = db.pins.unpin_message(guild.id, orig_msg.id)
+        pinned_msg_id = await self.loop.run_in_executor(
+            None, db.pins.unpin_message, guild.id, orig_msg.id)
         if not pinned_msg_id:
             return False
 
-        pins_channel = db.config.get_pins_channel(guild.id)
+        pins_channel = await self.loop.run_in_executor(
+            None, db.config.get_pins_channel, guild.id)
         if not pins_channel:
             await send_error(orig_msg.channel, ErrorStrings.no_pins_channel)
         pins_channel: discord.TextChannel = guild.get_channel(pins_channel)
@@ -901,7 +990,7 @@ class Hawkbot(discord.Client):
 
     async def get_his_ass(self, msg):
         chan = msg.channel
-        mem = self.channel_memory[chan]['get_his_ass']
+        mem = self.channel_memory[chan.id]['get_his_ass']
         mem.append(msg)
 
         if not msg.content:
@@ -912,14 +1001,13 @@ class Hawkbot(discord.Client):
             # unreliable; skip
             return False
 
-        users = [m.author for m in tuple(mem)[1:]]
-        contents = [m.content for m in tuple(mem)[1:]]
-        if len(set(users)) != len(users):
-            # Repeated user; skip
-            return False
-        elif len(set(contents)) != 1:
+        recent = list(islice(mem, 1, None))
+        if len({m.content for m in recent}) != 1:
             # Different messages; skip
             return False
+        if len({m.author for m in recent}) != len(recent):
+            # Repeated user; skip
+            return False
 
         predicted_gettee = mem[0].author.id
         pronoun = 'her' if predicted_gettee in {150722990663925760} else 'his'
@@ -931,11 +1019,7 @@ class Hawkbot(discord.Client):
 
     async def already_tracer(self, msg):
         chan = msg.channel
-        search = re.search(r"(?:i(?:m|'m| am|d|'d| would)? ?"
-                           "(?:wanna|want to|going to|gonna|like to) "
-                           # "be|(?:what|how) about) (.+)",
-                           "be) (.+)",
-                           msg.content, flags=re.I)
+        search = ALREADY_TRACER_RE.search(msg.content)
         if search:
             if search.group(1) == 'bastion':
                 await chan.send('nerf bastion')
@@ -944,8 +1028,7 @@ class Hawkbot(discord.Client):
 
     async def cee_lo(self, msg):
         me = msg.guild.me
-        if re.search(r'(?:cee ?lo|get (?:your|ur) ass back here)',
-                     msg.content, flags=re.I):
+        if CEE_LO_RE.search(msg.content):
             ceelo = ('get', 'your', ('a', 's', '5\U000020e3'), 'back',
                      ('h', 'e', 'r', '3\U000020e3'))
             await play_audio_file(msg, 'get_your_ass_back_here.wav')
@@ -957,8 +1040,10 @@ class Hawkbot(discord.Client):
                     to_remove.append(c)
                     await msg.add_reaction(c)
                 await asyncio.sleep(0.6)
-                for e in to_remove[::-1]:
-                    await msg.remove_reaction(e, me)
+                # Adds stay sequential since reactions display in the order
+                # they're added, but removal order doesn't matter
+                await asyncio.gather(*(msg.remove_reaction(e, me)
+                                       for e in to_remove))
             await msg.remove_reaction('▪', me)
 
     async def cheels(self, msg):
@@ -972,82 +1057,20 @@ class Hawkbot(discord.Client):
             await play_audio_file(msg, 'wa_ah.wav')
 
     async def doundrissit(self, msg):
-        content = msg.content.lower()
-        folder = Path('doundrissit')
-        if re.search(r'sc?hlow down', content):
-            await play_audio_file(msg, folder / 'schlow_down.wav')
-        elif re.search(r'rawky', content):
-            await play_audio_file(msg, folder / 'rawky.wav')
-        elif re.search(r'(?:slide down|doundrissit)', content):
-            await play_audio_file(msg, folder / 'doundrissit.wav')
-        elif re.search(r'chooses combat gear', content):
-            await play_audio_file(msg, folder / 'chooses_combat_gear.wav')
-        elif re.search(r'w[ao]lnum bolt?', content):
-            await play_audio_file(msg, folder / 'walnum_bolt.wav')
-        elif re.search(r'mother of god', content):
-            await play_audio_file(msg, folder / 'mother_of_god.wav')
-        elif re.search(r'mulled good', content):
-            await play_audio_file(msg, folder / 'mulled_good_baby.wav')
-        elif re.search(r'nill[yi] heeyah?', content):
-            await play_audio_file(msg, folder / 'nilly_heeya.wav')
-        elif re.search(r'(?:youorai|are you (?:alright|all right))', content):
-            await play_audio_file(msg, folder / 'youorai.wav')
+        match = DOUNDRISSIT_RE.search(msg.content.lower())
+        if match:
+            await play_audio_file(msg, DOUNDRISSIT_FILES[match.lastgroup])
 
     async def corolla(self, msg):
-        content = msg.content.lower()
-        folder = Path('corolla')
-        if re.search(r'a to b', content):
-            await play_audio_file(msg, folder / 'a_to_b.wav')
-        elif re.search(r'be that guy', content):
-            await play_audio_file(msg, folder / 'be_that_guy.wav')
-        elif re.search(r'coffee to strangers', content):
-            await play_audio_file(msg, folder / 'coffee_to_strangers.wav')
-        elif re.search(r'i wrote that book', content):
-            await play_audio_file(msg, folder / 'i_wrote_that_book.wav')
-        elif re.search(r'my dad', content):
-            await play_audio_file(msg, folder / 'my_dad.wav')
-        elif re.search(r'used to have a corolla', content):
-            await play_audio_file(msg, folder / 'used_to_have_a_corolla.wav')
-        elif re.search(r'yes,? i know that', content):
-            await play_audio_file(msg, folder / 'yes_i_know_that.wav')
-        elif re.search(r'you got here first', content):
-            await play_audio_file(msg, folder / 'you_got_here_first.wav')
+        match = COROLLA_RE.search(msg.content.lower())
+        if match:
+            await play_audio_file(msg, COROLLA_FILES[match.lastgroup])
 
     async def and_i_oop(self, msg):
         content = msg.content.lower()
         if 'and i oop' in content:
             await play_audio_file(msg, 'and_i_oop.wav')
 
-    async def sans(self, msg):
-        content = msg.content.lower()
-        if content == 'sans':
-            await play_audio_file(msg, 'sans.wav')
-
-    async def vsauce(self, msg):
-        content = msg.content.lower()
-        if content == 'v':
-            await play_audio_file(msg, 'vsauce.wav')
-
-    async def but_i_love_chef(self, msg):
-        content = msg.content.lower()
-        if content == 'but i love chef':
-            await play_audio_file(msg, 'but_i_love_chef.wav')
-
-    async def sayori(self, msg):
-        content = msg.content.lower()
-        if content in {'sayori', 'sayonara', 'door'}:
-            await play_audio_file(msg, 'd.wav')
-
-    async def ew(self, msg):
-        content = msg.content.lower()
-        if content == 'ew':
-            await play_audio_file(msg, 'EW_DUDE_WTF.wav')
-
-    async def crickets(self, msg):
-        content = msg.content.lower()
-        if content == 'crickets':
-            await play_audio_file(msg, 'crickets.wav')
-
 
 if __name__ == '__main__':
     logger.setLevel(logging.INFO)
@@ -1058,6 +1081,15 @@ if __name__ == '__main__':
 
     # discord.opus.load_opus('libopus-0.x64.dll')
 
+    if sys.platform != 'win32':
+        # uvloop isn't available on Windows
+        import uvloop
+        uvloop.install()
+
+    if db.main.pool is not None:
+        # Bring existing message tables up to date before handling commands
+        db.main.migrate_messages_tables()
+
     hawkbot = Hawkbot()
     try:
         hawkbot = hawkbot.run(config['discord']['bot_token'])
@@ -1,31 +1,54 @@
+import asyncio
 import base64
 from io import BytesIO
 from typing import Optional
 
-import requests
+import aiohttp
 
 url = "https://api.runwayml.com/v1/inference/runway/AttnGAN/default/generate"
 headers = {'content-type': 'application/json'}
+timeout = aiohttp.ClientTimeout(total=2)
 
+_session: Optional[aiohttp.ClientSession] = None
 
-def gan_image(text: str) -> Optional[BytesIO]:
+
+def _get_session() -> aiohttp.ClientSession:
+    # Created lazily so the session is bound to the running event loop
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(headers=headers, timeout=timeout)
+    return _session
+
+
+async def gan_image(text: str) -> Optional[BytesIO]:
     json_data = {'inputData': {'caption': text}}
     # noinspection PyBroadException
     try:
-        r = requests.post(url, headers=headers, json=json_data, timeout=2)
-    except requests.exceptions.ReadTimeout:
+        async with _get_session().post(url, json=json_data) as r:
+            if r.status != 200:
+                return None
+            body = await r.read()
+    except asyncio.TimeoutError:
         return None
     except Exception:
         return None
 
-    if r.status_code != requests.codes.ok:
+    # The body is {"result": "data:image/...;base64,<data>"}. Slice the
+    # payload out of the raw bytes rather than parsing the JSON and copying
+    # the string around. b64decode skips non-alphabet characters, so JSON
+    # escaped slashes (\/) are harmless.
+    try:
+        start = body.index(b';base64,') + len(b';base64,')
+        end = body.index(b'"', start)
+    except ValueError:
         return None
-
-    data_uri = r.json()['result']
-    header, encoded = data_uri.split(",", 1)
-    return BytesIO(base64.b64decode(encoded))
+    return BytesIO(base64.b64decode(memoryview(body)[start:end]))
 
 
 if __name__ == '__main__':
-    with open(r'C:\Users\Alex\Desktop\test.jpg', 'wb') as f:
-        f.write(gan_image('A man').read())
+    async def main():
+        with open(r'C:\Users\Alex\Desktop\test.jpg', 'wb') as f:
+            f.write((await gan_image('A man')).read())
+        await _get_session().close()
+
+    asyncio.run(main())
@@ -1,4 +1,9 @@
-import json
+from pathlib import Path
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 from utils.constants import DATA_FOLDER
 
@@ -6,18 +11,21 @@ from utils.constants import DATA_FOLDER
 class Config:
 
     def __init__(self, file):
-        with open(file) as f:
-            self._config = json.load(f)
+        self._config = json_loads(Path(file).read_bytes())
         self.env_name = self._config['env']
         self._env = self._config['envs'][self.env_name]
+        # Env settings override global ones; merge them once up front so
+        # lookups are a single dict probe
+        self._merged = {
+            **{k: v for k, v in self._config.items() if k != 'envs'},
+            **self._env
+        }
 
     def __getitem__(self, item):
-        if item in self._env:
-            return self._env[item]
-        return self._config[item]
+        return self._merged[item]
 
     def __contains__(self, item):
-        return item in self._env or item in self._config
+        return item in self._merged
 
 
 config = Config(DATA_FOLDER / 'config.json')
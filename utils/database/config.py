@@ -3,7 +3,7 @@ from typing import Optional, List, Union
 
 from mysql.connector.cursor import MySQLCursor
 
-from utils.database.main import cnx, supply_cursor, fix_missing_shared
+from utils.database.main import supply_cursor, fix_missing_shared
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,6 @@ def add_guild(guild_id: int, cur: MySQLCursor = None):
         INSERT INTO config (guild_id) VALUES (%s)
         ON DUPLICATE KEY UPDATE guild_id=guild_id
     ''', (guild_id,))
-    cnx.commit()
 
 
 @fix_missing_shared()
@@ -36,7 +35,6 @@ def set_prefix(guild_id: int, prefix: Optional[str], cur: MySQLCursor = None):
         UPDATE config SET prefix = %s
         WHERE guild_id = %s
     ''', (prefix, guild_id))
-    cnx.commit()
 
 
 @fix_missing_shared()
@@ -58,64 +56,49 @@ def set_pins_channel(guild_id: int, channel_id: Optional[int],
         UPDATE config SET pins_channel = %s
         WHERE guild_id = %s
     ''', (channel_id, guild_id))
-    cnx.commit()
-
-
-def _split_channel_download_blacklist(blacklist: Optional[str]):
-    if not blacklist:
-        return []
-    return list(map(int, blacklist.split(';')))
-
-
-def _join_channel_download_blacklist(blacklist: List[int]):
-    return ';'.join(map(str, blacklist))
 
 
 @fix_missing_shared()
 @supply_cursor()
 def get_channel_download_blacklist(guild_id: int, cur: MySQLCursor = None
-                                   ) -> Optional[List[int]]:
+                                   ) -> List[int]:
     cur.execute('''
-        SELECT channel_download_blacklist FROM config
+        SELECT channel_id FROM config_channel_blacklist
         WHERE guild_id = %s
     ''', (guild_id,))
-    result = cur.fetchone()
-    if result:
-        return _split_channel_download_blacklist(result[0])
-    return []
+    return [row[0] for row in cur]
 
 
 @fix_missing_shared()
 @supply_cursor()
-def set_channel_download_blacklist(guild_id: int, blacklist: str,
-                                   cur: MySQLCursor = None):
-    cur.execute('''
-        UPDATE config SET channel_download_blacklist = %s
-        WHERE guild_id = %s
-    ''', (blacklist, guild_id))
-    cnx.commit()
-
-
 def add_channel_to_download_blacklist(guild_id: int,
-                                      channel_ids: Union[int, List[int]]):
+                                      channel_ids: Union[int, List[int]],
+                                      cur: MySQLCursor = None):
     if isinstance(channel_ids, int):
         channel_ids = [channel_ids]
-    blacklist = _join_channel_download_blacklist(
-        get_channel_download_blacklist(guild_id) + channel_ids
-    )
-    set_channel_download_blacklist(guild_id, blacklist)
+    if not channel_ids:
+        return
+    # executemany sends this as a single multi-row INSERT
+    cur.executemany('''
+        INSERT IGNORE INTO config_channel_blacklist (guild_id, channel_id)
+        VALUES (%s,%s)
+    ''', [(guild_id, channel_id) for channel_id in channel_ids])
 
 
+@fix_missing_shared()
+@supply_cursor()
 def remove_channel_from_download_blacklist(guild_id: int,
-                                           channel_ids: Union[int, List[int]]):
+                                           channel_ids: Union[int, List[int]],
+                                           cur: MySQLCursor = None):
     if isinstance(channel_ids, int):
         channel_ids = [channel_ids]
-    blacklist_channels = get_channel_download_blacklist(guild_id)
-    for channel in channel_ids:
-        blacklist_channels.remove(channel)
-
-    blacklist = _join_channel_download_blacklist(blacklist_channels)
-    set_channel_download_blacklist(guild_id, blacklist)
+    if not channel_ids:
+        return
+    cur.execute(f'''
+        DELETE FROM config_channel_blacklist
+        WHERE guild_id = %s
+        AND channel_id IN ({",".join(["%s"] * len(channel_ids))})
+    ''', [guild_id, *channel_ids])
 
 
 if __name__ == '__main__':
@@ -1,8 +1,13 @@
 import functools
 import logging
+import queue
+import threading
+import time
+from typing import Iterable
 
-from discord import Guild, TextChannel, User
+from discord import Guild, TextChannel
 import mysql.connector
+from mysql.connector.abstracts import MySQLConnectionAbstract
 from mysql.connector.cursor import MySQLCursor
 from mysql.connector import errorcode
 
@@ -11,6 +16,52 @@ from utils.errors import typecheck
 import utils.database.config as db_config
 
 logger = logging.getLogger(__name__)
+# Maximum number of open connections. Database functions are run in executor
+# threads, and each thread uses its own connection.
+POOL_SIZE = 8
+# Only ping (and reconnect if needed) when a connection has been idle for
+# longer than this many seconds, rather than before every query
+PING_INTERVAL = 60
+
+
+class ConnectionPool:
+    """
+    A pool of MySQL connections. The most recently used idle connection is
+    handed out first, and a connection is only pinged when it's been idle for
+    longer than PING_INTERVAL. Acquiring blocks while all connections are in
+    use.
+    """
+
+    def __init__(self, size: int, **connect_kwargs):
+        self._connect_kwargs = connect_kwargs
+        # (connection, time last used) pairs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self) -> MySQLConnectionAbstract:
+        self._slots.acquire()
+        try:
+            try:
+                cnx, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return mysql.connector.connect(**self._connect_kwargs)
+            if time.monotonic() - last_used > PING_INTERVAL:
+                cnx.ping(reconnect=True)
+            return cnx
+        except Exception as e:
+            self._slots.release()
+            raise e
+
+    def release(self, cnx: MySQLConnectionAbstract, healthy: bool = True):
+        """
+        Return a connection to the pool
+
+        :param healthy: False if an error occurred while using the connection,
+            so it will be pinged when it's next acquired
+        """
+        self._idle.put((cnx, time.monotonic() if healthy else 0.0))
+        self._slots.release()
+
 
 if 'mysql' in config:
     if ('use_aws_secrets_manager' in config['mysql']
@@ -22,40 +73,89 @@ if 'mysql' in config:
     else:
         credentials = config['mysql']
 
-    cnx = mysql.connector.connect(
+    pool = ConnectionPool(
+        POOL_SIZE,
         user=credentials['username'],
         password=credentials['password'],
         host=credentials['host'],
         database=credentials['database'],
-        use_pure=True
+        # Use the C extension when it's available (it's included in the
+        # binary wheels); the connector falls back to pure Python otherwise
+        use_pure=False
     )
 else:
-    # TODO handle errors from attempting to use this null connection
+    # TODO handle errors from attempting to use this null pool
     logger.warning('MySQL database info is not configured.')
-    cnx = None
+    pool = None
 
+# Number of space separated words in a message, used to filter by word limit
+# without a regex
+_WORD_COUNT_COLUMN = '''
+    word_count SMALLINT UNSIGNED AS (
+        CHAR_LENGTH(content) - CHAR_LENGTH(REPLACE(content, ' ', '')) + 1
+    ) STORED
+'''
+# The connection held by the current thread while it's inside a
+# supply_cursor function, so nested calls reuse it
+_local = threading.local()
 
-def supply_cursor(*cur_args, close=True, **cur_kwargs):
+
+def supply_cursor(*cur_args, close=True, buffered=True, prepared=False,
+                  **cur_kwargs):
     """
     Use to supply a function with a `cur` MySQL cursor argument that will be
-    automatically closed
+    automatically closed. The cursor's connection is taken from the pool and
+    its transaction is committed when the function returns, or rolled back if
+    it raises. Nested calls in the same thread share the outer call's
+    connection and transaction.
 
     :param cur_args: args to pass to cnx.cursor
+    :param buffered: whether to fetch the whole result set on execute. Use an
+        unbuffered cursor to stream large results; every row must be read
+        before the connection can run another statement.
+    :param prepared: whether to use server-side prepared statements. A
+        statement is only prepared again when a different string object is
+        executed, so reuse the same string when executing it repeatedly.
+        Prepared cursors are always unbuffered and return plain tuples.
     :param cur_kwargs: kwargs to pass to cnx.cursor
     """
+    if prepared:
+        buffered = False
+
     def wrapper(f):
         @functools.wraps(f)
         def wrapped(*args, **kwargs):
-            cnx.ping(reconnect=True)
-            cur = cnx.cursor(*cur_args, buffered=True, **cur_kwargs)
+            cnx = getattr(_local, 'cnx', None)
+            if cnx is not None:
+                # Nested call; the outer call commits
+                cur = cnx.cursor(*cur_args, buffered=buffered,
+                                 prepared=prepared, **cur_kwargs)
+                try:
+                    return f(*args, **kwargs, cur=cur)
+                finally:
+                    if close:
+                        cur.close()
+
+            cnx = pool.acquire()
+            _local.cnx = cnx
+            healthy = False
             try:
-                return f(*args, **kwargs, cur=cur)
-            except Exception as e:
-                cur.close()
-                raise e
+                cur = cnx.cursor(*cur_args, buffered=buffered,
+                                 prepared=prepared, **cur_kwargs)
+                try:
+                    result = f(*args, **kwargs, cur=cur)
+                    cnx.commit()
+                except Exception as e:
+                    cnx.rollback()
+                    raise e
+                finally:
+                    if close:
+                        cur.close()
+                healthy = True
+                return result
             finally:
-                if close:
-                    cur.close()
+                _local.cnx = None
+                pool.release(cnx, healthy)
         return wrapped
     return wrapper
 
@@ -65,7 +165,7 @@ def fix_missing_shared(return_none_if_missing: bool = False):
         @functools.wraps(f)
         def wrapped(*args, **kwargs):
             try:
-                f(*args, **kwargs)
+                result = f(*args, **kwargs)
 
             except mysql.connector.Error as e:
                 if e.errno == errorcode.ER_NO_SUCH_TABLE:
@@ -74,7 +174,7 @@ def fix_missing_shared(return_none_if_missing: bool = False):
                         return None
                     return wrapped(*args, **kwargs)
                 raise e
-            return f(*args, **kwargs)
+            return result
         return wrapped
     return wrapper
 
@@ -82,29 +182,81 @@ def fix_missing_shared(return_none_if_missing: bool = False):
 @supply_cursor()
 def init_shared(cur: MySQLCursor = None):
     cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            key_id SMALLINT UNSIGNED AUTO_INCREMENT,
-            id BIGINT UNSIGNED NOT NULL UNIQUE,
-            name VARCHAR(32) NOT NULL,
-            discriminator SMALLINT UNSIGNED NOT NULL,
-            PRIMARY KEY (key_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS channels (
-            key_id SMALLINT UNSIGNED AUTO_INCREMENT,
-            id BIGINT UNSIGNED NOT NULL UNIQUE,
-            name VARCHAR(100) NOT NULL,
-            PRIMARY KEY (key_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS config (
-            guild_id BIGINT UNSIGNED NOT NULL,
-            prefix VARCHAR(255),
-            pins_channel BIGINT UNSIGNED,
-            channel_download_blacklist TEXT,
-            PRIMARY KEY (guild_id)
-        );
-    ''', multi=True)
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = DATABASE()
+            AND table_name = 'config_channel_blacklist'
+    ''')
+    blacklist_existed = cur.fetchone()[0]
+
+    # Executed one by one; with multi=True a statement only runs when its
+    # result is iterated, which was never done
+    for statement in (
+        '''
+            CREATE TABLE IF NOT EXISTS users (
+                key_id SMALLINT UNSIGNED AUTO_INCREMENT,
+                id BIGINT UNSIGNED NOT NULL UNIQUE,
+                name VARCHAR(32) NOT NULL,
+                discriminator SMALLINT UNSIGNED NOT NULL,
+                PRIMARY KEY (key_id)
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS channels (
+                key_id SMALLINT UNSIGNED AUTO_INCREMENT,
+                id BIGINT UNSIGNED NOT NULL UNIQUE,
+                name VARCHAR(100) NOT NULL,
+                PRIMARY KEY (key_id)
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS config (
+                guild_id BIGINT UNSIGNED NOT NULL,
+                prefix VARCHAR(255),
+                pins_channel BIGINT UNSIGNED,
+                PRIMARY KEY (guild_id)
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS config_channel_blacklist (
+                guild_id BIGINT UNSIGNED NOT NULL,
+                channel_id BIGINT UNSIGNED NOT NULL,
+                PRIMARY KEY (guild_id, channel_id)
+            )
+        ''',
+    ):
+        cur.execute(statement)
+
+    if not blacklist_existed:
+        _migrate_channel_blacklist(cur)
+
+
+def _migrate_channel_blacklist(cur: MySQLCursor):
+    """
+    Copy blacklists from the ';' separated channel_download_blacklist column
+    which config_channel_blacklist replaced. The old column is left in place.
+    """
+    cur.execute('''
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'config'
+            AND column_name = 'channel_download_blacklist'
+    ''')
+    if not cur.fetchone()[0]:
+        return
+    cur.execute('''
+        SELECT guild_id, channel_download_blacklist FROM config
+        WHERE channel_download_blacklist IS NOT NULL
+    ''')
+    rows = [(guild_id, int(channel_id))
+            for guild_id, blacklist in cur.fetchall()
+            for channel_id in blacklist.split(';') if channel_id]
+    if not rows:
+        return
+    logger.info(f'Migrating {len(rows)} blacklisted channels to '
+                f'config_channel_blacklist')
+    cur.executemany('''
+        INSERT IGNORE INTO config_channel_blacklist (guild_id, channel_id)
+        VALUES (%s,%s)
+    ''', rows)
 
 
 @supply_cursor()
@@ -112,74 +264,100 @@ def init_guild(guild: Guild, cur: MySQLCursor = None):
     guild_id = guild.id
     typecheck(guild_id, int, 'guild_id')
 
-    cur.execute(f'''
-        CREATE TABLE IF NOT EXISTS g{guild_id}_messages (
-            id BIGINT UNSIGNED NOT NULL,
-            user SMALLINT UNSIGNED NOT NULL,
-            channel SMALLINT UNSIGNED NOT NULL,
-            timestamp DATETIME NOT NULL,
-            content TEXT NOT NULL,
-            images TEXT,
-            PRIMARY KEY (id),
-            INDEX (user),
-            INDEX (channel)
-        );
-
-        CREATE TABLE IF NOT EXISTS g{guild_id}_markov (
-            user SMALLINT UNSIGNED NOT NULL,
-            channel SMALLINT UNSIGNED NOT NULL,
-            base TEXT,
-            potentials MEDIUMTEXT,
-            INDEX (user),
-            INDEX (channel),
-            INDEX (base(32))
-        );
-        
-        CREATE TABLE IF NOT EXISTS g{guild_id}_pos_tags (
-            user SMALLINT UNSIGNED NOT NULL,
-            channel SMALLINT UNSIGNED NOT NULL,
-            tag VARCHAR(8) NOT NULL,
-            word TEXT NOT NULL,
-            use_count MEDIUMINT UNSIGNED DEFAULT 0,
-            INDEX (user),
-            INDEX (channel),
-            INDEX (tag(3)),
-            UNIQUE KEY unique_entry (user, channel, tag, word(32))
-        );
-
-        CREATE TABLE IF NOT EXISTS g{guild_id}_pins (
-            original BIGINT UNSIGNED NOT NULL,
-            pin BIGINT UNSIGNED NOT NULL
-        );
-    ''', multi=True)
+    for statement in (
+        f'''
+            CREATE TABLE IF NOT EXISTS g{guild_id}_messages (
+                id BIGINT UNSIGNED NOT NULL,
+                user SMALLINT UNSIGNED NOT NULL,
+                channel SMALLINT UNSIGNED NOT NULL,
+                timestamp DATETIME NOT NULL,
+                content TEXT NOT NULL,
+                images TEXT,
+                {_WORD_COUNT_COLUMN},
+                PRIMARY KEY (id),
+                INDEX (user),
+                INDEX (channel),
+                INDEX (word_count)
+            )
+        ''',
+        f'''
+            CREATE TABLE IF NOT EXISTS g{guild_id}_markov (
+                user SMALLINT UNSIGNED NOT NULL,
+                channel SMALLINT UNSIGNED NOT NULL,
+                base TEXT,
+                potentials MEDIUMTEXT,
+                INDEX (user),
+                INDEX (channel),
+                INDEX (base(32))
+            )
+        ''',
+        f'''
+            CREATE TABLE IF NOT EXISTS g{guild_id}_pos_tags (
+                user SMALLINT UNSIGNED NOT NULL,
+                channel SMALLINT UNSIGNED NOT NULL,
+                tag VARCHAR(8) NOT NULL,
+                word TEXT NOT NULL,
+                use_count MEDIUMINT UNSIGNED DEFAULT 0,
+                INDEX (user),
+                INDEX (channel),
+                INDEX (tag(3)),
+                UNIQUE KEY unique_entry (user, channel, tag, word(32))
+            )
+        ''',
+        f'''
+            CREATE TABLE IF NOT EXISTS g{guild_id}_pins (
+                original BIGINT UNSIGNED NOT NULL,
+                pin BIGINT UNSIGNED NOT NULL
+            )
+        ''',
+    ):
+        cur.execute(statement)
 
+    migrate_messages_tables()
     db_config.add_guild(guild_id)
-
-    for channel in guild.text_channels:
-        add_channel(channel)
+    add_channels(guild.text_channels)
 
 
-@fix_missing_shared()
 @supply_cursor()
-def add_channel(channel: TextChannel, cur: MySQLCursor = None):
+def migrate_messages_tables(cur: MySQLCursor = None):
+    """
+    Add the word count column to message tables created before it was part of
+    the schema. Queries on messages rely on it, so run this at startup.
+    """
     cur.execute('''
-        INSERT INTO channels (id, name) VALUES (%s,%s)
-        ON DUPLICATE KEY UPDATE id=id
-    ''', (channel.id, channel.name))
-    cnx.commit()
+        SELECT t.table_name FROM information_schema.tables AS t
+        WHERE t.table_schema = DATABASE()
+            AND t.table_name REGEXP '^g[0-9]+_messages$'
+            AND NOT EXISTS (
+                SELECT * FROM information_schema.columns AS c
+                WHERE c.table_schema = t.table_schema
+                    AND c.table_name = t.table_name
+                    AND c.column_name = 'word_count'
+            )
+    ''')
+    for table, in cur.fetchall():
+        logger.info(f'Adding word count to {table}')
+        cur.execute(f'''
+            ALTER TABLE {table}
+            ADD COLUMN {_WORD_COUNT_COLUMN},
+            ADD INDEX (word_count)
+        ''')
 
 
 @fix_missing_shared()
 @supply_cursor()
-def add_user(user: User, cur: MySQLCursor = None):
-    cur.execute('''
-        INSERT INTO users (id, name, discriminator)
-        VALUES (%s,%s,%s)
+def add_channels(channels: Iterable[TextChannel], cur: MySQLCursor = None):
+    """Add any channels that aren't already in the database"""
+    rows = [(channel.id, channel.name) for channel in channels]
+    if not rows:
+        return
+    cur.executemany('''
+        INSERT INTO channels (id, name) VALUES (%s,%s)
         ON DUPLICATE KEY UPDATE id=id
-    ''', (user.id, user.name, user.discriminator))
-    cnx.commit()
+    ''', rows)
 
 
+@functools.lru_cache(maxsize=4096)
 @fix_missing_shared(return_none_if_missing=True)
 @supply_cursor()
 def user_name_from_id(id_: int, cur: MySQLCursor):
@@ -1,8 +1,6 @@
-from collections import defaultdict
 import functools
-from functools import partial
 import logging
-from typing import Iterable, Optional, List
+from typing import Optional, List
 
 import mysql.connector
 from mysql.connector import errorcode
@@ -10,7 +8,7 @@ from mysql.connector.cursor import MySQLCursor
 
 from utils.errors import typecheck, UserFeedbackError
 from utils.database.misc import flat_pruned_list
-from utils.database.main import cnx, supply_cursor
+from utils.database.main import supply_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +16,11 @@ logger = logging.getLogger(__name__)
 def _create_where_statement(users: int = 0,
                             channels: int = 0,
                             base: bool = False):
-    users = int(users)
-    channels = int(channels)
-    base = bool(base)
+    return _where_statement(int(users), int(channels), bool(base))
 
+
+@functools.lru_cache(maxsize=64)
+def _where_statement(users: int, channels: int, base: bool):
     where = ' AND '.join([i for i in [
         users and f'user IN (SELECT key_id FROM users '
                   f'WHERE id IN ({",".join(["%s"] * users)}))',
@@ -36,68 +35,86 @@ def alert_missing_chain(f):
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         try:
-            f(*args, **kwargs)
+            result = f(*args, **kwargs)
         except mysql.connector.Error as e:
             if e.errno == errorcode.ER_NO_SUCH_TABLE:
                 raise UserFeedbackError('No chain collected for this server')
             raise e
-        return f(*args, **kwargs)
+        return result
     return wrapped
 
 
-# noinspection SqlResolve
-@alert_missing_chain
-@supply_cursor()
-def _insert_to_chain(guild_id: int, user: int, channel: int, base: str,
-                     potentials: Iterable[str], cur: MySQLCursor = None):
-    potentials = ' '.join(potentials)
-    cur.execute(f'''
-        INSERT INTO g{guild_id}_markov
-        (user, channel, base, potentials)
-        VALUES (
-            (SELECT key_id FROM users WHERE id=%s),
-            (SELECT key_id FROM channels WHERE id=%s),
-            %s,%s
-        )
-    ''', (user, channel, base, potentials))
-    cnx.commit()
-
-
-def _make_pairs(msg: str):
-    msg = msg.split(' ')
-    for i in range(0, len(msg)):
-        if i == 0:
-            yield ('', msg[0])
-        else:
-            yield (msg[i-1], msg[i])
-    yield (msg[len(msg)-1], '')
-
-
 # noinspection SqlResolve
 @alert_missing_chain
 @supply_cursor()
 def create_chain(guild_id: int, cur: MySQLCursor = None):
     typecheck(guild_id, int, 'guild_id')
     logger.info(f'Creating chain for server {guild_id}')
-    # Structure: chain[user_id][channel][base] = potentials
-    user_chains = defaultdict(partial(defaultdict, partial(defaultdict, set)))
-
+    # The chain is built entirely by MySQL so the messages never leave the
+    # server. The recursive CTE splits each message on spaces into
+    # (base, potential) pairs, including ('', first word) and
+    # (last word, ''). `state` is 1 while `rest` holds more words, 0 when
+    # `potential` is the last word, and -1 for the final pair.
+    # Pairs are compared with a binary collation to match how Python
+    # compares strings.
+    # The CTE recurses once per word of the longest message (messages are at
+    # most 4000 characters), and a base's potentials can be much longer than
+    # the default 1024 byte GROUP_CONCAT limit. Each step copies the rest of
+    # the message, so a message costs O(words * length) rather than the
+    # O(length) of splitting it in Python.
+    # The connection goes back to the pool afterwards, so restore the
+    # session's limits when done.
+    cur.execute('''
+        SELECT @@SESSION.cte_max_recursion_depth,
+               @@SESSION.group_concat_max_len
+    ''')
+    max_recursion_depth, group_concat_max_len = cur.fetchone()
+    cur.execute('SET SESSION cte_max_recursion_depth = 4001')
+    cur.execute('SET SESSION group_concat_max_len = 16777215')
+    try:
+        _insert_chain(guild_id, cur)
+    finally:
+        cur.execute('SET SESSION cte_max_recursion_depth = %s',
+                    (max_recursion_depth,))
+        cur.execute('SET SESSION group_concat_max_len = %s',
+                    (group_concat_max_len,))
+
+
+def _insert_chain(guild_id: int, cur: MySQLCursor):
     cur.execute(f'''
-        SELECT users.id, channels.id, content FROM g{guild_id}_messages AS msgs
-        INNER JOIN users ON (msgs.user = users.key_id)
-        INNER JOIN channels ON (msgs.channel = channels.key_id)
-        WHERE content <> ''
+        INSERT INTO g{guild_id}_markov (user, channel, base, potentials)
+        WITH RECURSIVE pairs (user, channel, base, potential, rest, state) AS (
+            SELECT
+                user, channel,
+                CAST('' AS CHAR(4000) CHARACTER SET utf8mb4)
+                    COLLATE utf8mb4_bin,
+                CAST(SUBSTRING_INDEX(content, ' ', 1)
+                     AS CHAR(4000) CHARACTER SET utf8mb4)
+                    COLLATE utf8mb4_bin,
+                CAST(IF(LOCATE(' ', content),
+                        SUBSTRING(content, LOCATE(' ', content) + 1), '')
+                     AS CHAR(4000) CHARACTER SET utf8mb4)
+                    COLLATE utf8mb4_bin,
+                CAST(LOCATE(' ', content) > 0 AS SIGNED)
+            FROM g{guild_id}_messages
+            WHERE content <> ''
+            UNION ALL
+            SELECT
+                user, channel,
+                potential,
+                IF(state = 1, SUBSTRING_INDEX(rest, ' ', 1), ''),
+                IF(state = 1 AND LOCATE(' ', rest),
+                   SUBSTRING(rest, LOCATE(' ', rest) + 1), ''),
+                IF(state = 1, LOCATE(' ', rest) > 0, -1)
+            FROM pairs
+            WHERE state >= 0
+        )
+        SELECT user, channel, base,
+               GROUP_CONCAT(DISTINCT potential SEPARATOR ' ')
+        FROM pairs
+        GROUP BY user, channel, base
     ''')
 
-    for user_id, channel_id, content in cur:
-        for base, potential in _make_pairs(content):
-            user_chains[user_id][channel_id][base].add(potential)
-
-    for user, channels in user_chains.items():
-        for channel, chain in channels.items():
-            for base, potentials in chain.items():
-                _insert_to_chain(guild_id, user, channel, base, potentials)
-
 
 # noinspection SqlResolve
 @alert_missing_chain
@@ -1,9 +1,13 @@
+import asyncio
+from collections import namedtuple
 from collections.abc import Sequence
 import datetime as dt
 import functools
 import logging
+import random
+import re
 import sqlite3
-from typing import Union, Optional, List
+from typing import Collection, Dict, Union, Optional, List, Pattern
 
 import discord
 import mysql.connector
@@ -11,13 +15,18 @@ from mysql.connector import errorcode
 from mysql.connector.cursor import MySQLCursor
 
 from utils.database.config import get_channel_download_blacklist
-from utils.database.main import cnx, init_guild, add_channel, add_user,\
-    supply_cursor
+from utils.database.main import init_guild, supply_cursor, \
+    user_name_from_id
 from utils.database.misc import flat_pruned_list, LimitTuple
 from utils.errors import typecheck, UserFeedbackError
 
 logger = logging.getLogger(__name__)
 IMAGE_TYPES = {'bmp', 'gif', 'gifv', 'jpg', 'jpeg', 'png', 'webp'}
+# Messages buffered per insert while downloading a channel
+DOWNLOAD_BATCH_SIZE = 500
+
+MessageRow = namedtuple('MessageRow', 'msg_id channel_id user_name '
+                                      'timestamp content images')
 
 
 class SkippedBlacklistedChannel(Exception):
@@ -25,24 +34,30 @@ class SkippedBlacklistedChannel(Exception):
 
 
 def _create_where_statement(id_: bool = False,
+                            exclude: int = 0,
                             user: int = 0,
                             channel: int = 0,
                             timestamp: bool = False,
                             regex: bool = False,
                             content: bool = False,
                             images: bool = False,
+                            word_count: bool = False,
                             case_sensitive: bool = False):
-    id_ = bool(id_)
-    user = int(user)
-    channel = int(channel)
-    timestamp = bool(timestamp)
-    regex = bool(regex)
-    content = bool(content)
-    images = bool(images)
-    case_sensitive = bool(case_sensitive)
+    # Normalize the arguments so equivalent calls share a cache entry
+    return _where_statement(
+        bool(id_), int(exclude), int(user), int(channel), bool(timestamp),
+        bool(regex), bool(content), bool(images), bool(word_count),
+        bool(case_sensitive)
+    )
+
 
+@functools.lru_cache(maxsize=64)
+def _where_statement(id_: bool, exclude: int, user: int, channel: int,
+                     timestamp: bool, regex: bool, content: bool,
+                     images: bool, word_count: bool, case_sensitive: bool):
     where = ' AND '.join([i for i in [
         id_ and f'id BETWEEN %s AND %s',
+        exclude and f'id NOT IN ({",".join(["%s"]*exclude)})',
         user and f'user IN (SELECT key_id FROM users '
                  f'WHERE id IN ({",".join(["%s"]*user)}))',
         channel and f'channel IN (SELECT key_id FROM channels '
@@ -51,11 +66,27 @@ def _create_where_statement(id_: bool = False,
         regex and ('content REGEXP %s' if case_sensitive
                    else 'LOWER(content) REGEXP LOWER(%s)'),
         content and 'content <> ""',
-        images and 'images IS NOT NULL'
+        images and 'images IS NOT NULL',
+        word_count and 'word_count >= %s'
     ] if i])
     return f'WHERE {where}' if where else ''
 
 
+@functools.lru_cache(maxsize=16)
+def _word_limit_re(min_words: Optional[int],
+                   max_words: Optional[int]) -> Pattern:
+    """
+    Compile a pattern matching messages of space separated words with a word
+    count within the limits
+
+    :param min_words: minimum word count, or None for no minimum
+    :param max_words: maximum word count, or None for no maximum
+    """
+    min_ = min_words - 1 if min_words else ''
+    max_ = max_words - 1 if max_words else ''
+    return re.compile(rf'^(?:\S+ +){{{min_},{max_}}}\S+$')
+
+
 def alert_missing_messages(return_none_if_missing=False):
     def wrapper(f):
         @functools.wraps(f)
@@ -105,30 +136,61 @@ def _get_most_recent_update(guild_id: int, channel_id: int,
     return timestamp[0] if timestamp else None
 
 
+def _get_key_ids(table: str, ids: Collection[int],
+                 cur: MySQLCursor) -> Dict[int, int]:
+    """
+    Map Discord ids to key ids in the users or channels table
+
+    :param table: "users" or "channels"
+    :param ids: Discord ids to look up
+    """
+    cur.execute(f'''
+        SELECT id, key_id FROM {table}
+        WHERE id IN ({",".join(["%s"] * len(ids))})
+    ''', tuple(ids))
+    return dict(cur)
+
+
 # noinspection SqlResolve
 @alert_missing_messages()
 @supply_cursor()
-def _insert_message(msg: discord.Message, cur: MySQLCursor = None):
-    guild_id = msg.guild.id
+def _insert_messages(guild_id: int, msgs: List[discord.Message],
+                     cur: MySQLCursor = None):
     typecheck(guild_id, int, 'guild_id')
-    images = _get_images_urls(msg)
-    if images:
-        images = ';'.join(images)
-
-    add_user(msg.author)
-    add_channel(msg.channel)
-    cur.execute(f'''
+    if not msgs:
+        return
+    authors = {m.author.id: m.author for m in msgs}
+    channels = {m.channel.id: m.channel for m in msgs}
+
+    # Register this batch's authors and channels once, then look up all of
+    # their key ids at once
+    cur.executemany('''
+        INSERT INTO users (id, name, discriminator)
+        VALUES (%s,%s,%s)
+        ON DUPLICATE KEY UPDATE id=id
+    ''', [(u.id, u.name, u.discriminator) for u in authors.values()])
+    cur.executemany('''
+        INSERT INTO channels (id, name) VALUES (%s,%s)
+        ON DUPLICATE KEY UPDATE id=id
+    ''', [(c.id, c.name) for c in channels.values()])
+    user_keys = _get_key_ids('users', authors, cur)
+    channel_keys = _get_key_ids('channels', channels, cur)
+
+    rows = []
+    for msg in msgs:
+        images = _get_images_urls(msg)
+        if images:
+            images = ';'.join(images)
+        rows.append((msg.id, user_keys[msg.author.id],
+                     channel_keys[msg.channel.id], msg.created_at,
+                     msg.content, images))
+
+    cur.executemany(f'''
         INSERT INTO g{guild_id}_messages (
             id, user, channel, timestamp, content, images
-        ) VALUES (
-            %s,
-            (SELECT key_id FROM users WHERE id=%s),
-            (SELECT key_id FROM channels WHERE id=%s),
-            %s,%s,%s
-        )
-    ''', (msg.id, msg.author.id, msg.channel.id, msg.created_at,
-          msg.content, images))
-    cnx.commit()
+        ) VALUES (%s,%s,%s,%s,%s,%s)
+    ''', rows)
+    user_name_from_id.cache_clear()
 
 
 async def download_messages(source: Union[discord.Guild, discord.TextChannel]):
@@ -139,24 +201,56 @@ async def download_messages(source: Union[discord.Guild, discord.TextChannel]):
     elif isinstance(source, discord.TextChannel):
         logger.info(f'Collecting messages from {source.id} (#{source.name}) '
                     f'in guild {source.guild.id} ({source.guild.name})')
-        init_guild(source.guild)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, init_guild, source.guild)
 
-        blacklist = get_channel_download_blacklist(source.guild.id)
+        blacklist = await loop.run_in_executor(
+            None, get_channel_download_blacklist, source.guild.id)
         if blacklist and source.id in blacklist:
             raise SkippedBlacklistedChannel
 
-        after = _get_most_recent_update(source.guild.id, source.id)
+        after = await loop.run_in_executor(
+            None, _get_most_recent_update, source.guild.id, source.id)
         # TODO it's skipping the first message sent in updated channels
         skip_first = after is not None
+        batch = []
+        # The previous batch's insert, left running while the next batch is
+        # fetched from Discord. Awaiting it before starting another keeps
+        # inserts in order and surfaces any error.
+        pending = None
         try:
-            async for msg in source.history(limit=None, after=after,
-                                            oldest_first=True):
-                if skip_first:
-                    skip_first = False
-                    continue
-                if msg.author.bot or msg.type != discord.MessageType.default:
-                    continue
-                _insert_message(msg)
+            try:
+                async for msg in source.history(limit=None, after=after,
+                                                oldest_first=True):
+                    if skip_first:
+                        skip_first = False
+                        continue
+                    if (msg.author.bot
+                            or msg.type != discord.MessageType.default):
+                        continue
+                    batch.append(msg)
+                    if len(batch) >= DOWNLOAD_BATCH_SIZE:
+                        if pending:
+                            previous, pending = pending, None
+                            await previous
+                        pending = loop.run_in_executor(
+                            None, _insert_messages, source.guild.id, batch)
+                        batch = []
+            except Exception:
+                # Let the last insert finish so it doesn't run on into the
+                # next channel. Log its error rather than raising it, so the
+                # fetch error is the one that's handled.
+                if pending:
+                    try:
+                        await pending
+                    except Exception:
+                        logger.exception(f'Failed to insert messages from '
+                                         f'{source.id} ({source.name})')
+                raise
+            if pending:
+                await pending
+            await loop.run_in_executor(None, _insert_messages,
+                                       source.guild.id, batch)
 
         except discord.errors.Forbidden as e:
             logger.info(f'Access denied to {source.id} ({source.name})')
@@ -172,7 +266,7 @@ async def download_messages(source: Union[discord.Guild, discord.TextChannel]):
 
 # noinspection SqlResolve
 @alert_missing_messages()
-@supply_cursor(close=False, named_tuple=True)
+@supply_cursor(prepared=True)
 def random_message(guild_id: int,
                    users: Optional[List[int]] = None,
                    channel: Optional[int] = None,
@@ -180,46 +274,111 @@ def random_message(guild_id: int,
                    count: int = 1,
                    content: bool = False,
                    images: bool = False,
-                   cur: MySQLCursor = None):
+                   cur: MySQLCursor = None) -> List[MessageRow]:
+    """
+    Get random messages from a guild
+
+    :return: a list of up to `count` message rows
+    """
     typecheck(guild_id, int, 'guild_id')
     if isinstance(word_limit, Sequence) and not any(word_limit):
         word_limit = None
+    # word_count counts spaces, so runs of spaces make it larger than the
+    # number of words. It can only narrow down the minimum; the word limit
+    # regex checks the maximum.
+    min_words = word_limit[0] if word_limit else None
 
-    # Case insensitivity was screwing with the word limit
-    # regex pattern (\S -> \s)
+    select = '''
+        SELECT msgs.id as msg_id, channels.id as channel_id,
+               users.name as user_name, timestamp, content, images
+    '''
+    joins = '''
+        INNER JOIN channels ON (msgs.channel = channels.key_id)
+        INNER JOIN users ON (msgs.user = users.key_id)
+    '''
+
+    cur.execute(f'SELECT MIN(id), MAX(id) FROM g{guild_id}_messages')
+    min_id, max_id = cur.fetchall()[0]
+    if min_id is None:
+        return []
+
+    # Rather than sorting the whole table with ORDER BY RAND(), pick random
+    # snowflakes and take the first matching message at or after each one,
+    # which is a primary key range scan. Messages following a large gap in
+    # ids are somewhat more likely to be picked.
     where_stmt = _create_where_statement(
+        id_=True,
         user=len(users) if users else 0,
         channel=1 if channel else 0,
-        regex=bool(word_limit),
-        content=content,
+        content=content or bool(word_limit),
         images=images,
-        case_sensitive=True
+        word_count=bool(min_words)
     )
-    word_limit_regex = None
-    if word_limit:
-        min_ = word_limit[0]-1 if word_limit[0] else ''
-        max_ = word_limit[1]-1 if word_limit[1] else ''
-        word_limit_regex = (
-            rf'^(?:\S+ +){{{min_},{max_}}}\S+$')
-
-    # https://stackoverflow.com/a/41581041
     script = f'''
-        SELECT msgs.id as msg_id, channels.id as channel_id,
-               users.name as user_name, timestamp, content, images
-        FROM g{guild_id}_messages AS msgs
-        INNER JOIN channels ON (msgs.channel = channels.key_id)
-        INNER JOIN users ON (msgs.user = users.key_id)
-        WHERE msgs.id IN (
-            SELECT id FROM (
-                SELECT id FROM g{guild_id}_messages
+        {select}
+        FROM (
+            SELECT * FROM g{guild_id}_messages
+            {where_stmt}
+            ORDER BY id LIMIT 1
+        ) AS msgs
+        {joins}
+    '''
+    filters = flat_pruned_list(users, channel, min_words)
+    # word_count only counts spaces, so check the exact word limit here
+    word_limit_re = _word_limit_re(*word_limit) if word_limit else None
+
+    # The same script object is executed every probe so it's only prepared
+    # once
+    found = {}
+    for _ in range(count * 2):
+        if len(found) >= count:
+            break
+        target = random.randint(min_id, max_id)
+        cur.execute(script, [target, max_id, *filters])
+        rows = cur.fetchall()
+        if not rows:
+            # Nothing matches after the target, so wrap around to the start
+            cur.execute(script, [min_id, target, *filters])
+            rows = cur.fetchall()
+            if not rows:
+                # Nothing matches at all
+                return list(found.values())
+        row = MessageRow._make(rows[0])
+        if word_limit_re and not word_limit_re.match(row.content):
+            continue
+        found[row.msg_id] = row
+
+    if len(found) < count:
+        # When the filters match few messages, most probes land on the same
+        # ones, so fill in the rest by randomly sorting the matches
+        where_stmt = _create_where_statement(
+            exclude=len(found),
+            user=len(users) if users else 0,
+            channel=1 if channel else 0,
+            regex=bool(word_limit),
+            content=content or bool(word_limit),
+            images=images,
+            word_count=bool(min_words),
+            # Case insensitivity was screwing with the word limit
+            # regex pattern (\S -> \s)
+            case_sensitive=True
+        )
+        cur.execute(f'''
+            {select}
+            FROM (
+                SELECT * FROM g{guild_id}_messages
                 {where_stmt}
                 ORDER BY RAND() LIMIT %s
-            ) t
-        )
-    '''
-    cur.execute(script, flat_pruned_list(users, channel, word_limit_regex,
-                                         count))
-    return cur
+            ) AS msgs
+            {joins}
+        ''', flat_pruned_list(
+            list(found), users, channel,
+            word_limit_re.pattern if word_limit_re else None, min_words,
+            count - len(found)
+        ))
+        for row in map(MessageRow._make, cur.fetchall()):
+            found[row.msg_id] = row
+    return list(found.values())
 
 
 # noinspection SqlResolve
@@ -250,7 +409,7 @@ def message_stats(guild_id: int,
             GROUP BY user
             ORDER BY users.name
         ''', flat_pruned_list(users, channels, pattern))
-        return cur
+        return cur.fetchall()
     else:
         cur.execute(f'''
             SELECT
@@ -263,10 +422,10 @@ def message_stats(guild_id: int,
             GROUP BY user, DATE_FORMAT(timestamp, '%Y-%m-%d')
             ORDER BY timestamp
         ''', flat_pruned_list(users, channels, pattern))
-        return cur
+        return cur.fetchall()
 
 
 if __name__ == '__main__':
-    # print(repr(random_message(288545683462553610).fetchone()))
-    print(repr(random_message(288545683462553610, images=True).fetchone()))
+    # print(repr(random_message(288545683462553610)))
+    print(repr(random_message(288545683462553610, images=True)))
     # print(_get_most_recent_update(288545683462553610, 536970318762475550))
@@ -1,15 +1,51 @@
-from typing import Iterable, Tuple, Optional
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, Optional
+
+from mysql.connector.cursor import MySQLCursor
 
 LimitTuple = Tuple[Optional[int], Optional[int]]
+# Rows per executemany call when bulk inserting
+INSERT_BATCH_SIZE = 1000
+# Rows per fetchmany call when streaming results
+FETCH_BATCH_SIZE = 1000
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most `size` items"""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def batched_fetch(cur: MySQLCursor, size: int = FETCH_BATCH_SIZE) -> Iterator:
+    """
+    Iterate over a cursor's rows, fetching them `size` at a time. Rows are
+    converted in bulk, which is cheaper than fetching them one by one when
+    streaming from an unbuffered cursor.
+    """
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
 
 
 def flat_pruned_list(*args):
     out = []
+    append = out.append
+    extend = out.extend
     for i in args:
-        if i is not None:
-            if isinstance(i, Iterable) and not isinstance(i, str):
-                for j in i:
-                    out.append(j)
-            else:
-                out.append(i)
+        if i is None:
+            continue
+        # Check the common exact types first to skip the slower ABC checks
+        t = type(i)
+        if t is list or t is tuple:
+            extend(i)
+        elif t is str or not isinstance(i, Iterable):
+            append(i)
+        else:
+            extend(i)
     return out
@@ -1,33 +1,38 @@
 import functools
+import threading
 from typing import Optional
 
 import mysql.connector
 from mysql.connector import errorcode
 from mysql.connector.cursor import MySQLCursor
 
-from utils.database.main import supply_cursor, cnx
+from utils.database.main import supply_cursor
 from utils.errors import typecheck, UserFeedbackError
+from utils.misc import SizedDict
+
+# Pin message ids (or None) keyed by (guild id, original message id). Pins
+# only change through pin_message and unpin_message, which update this after
+# their transaction commits. Lookups only fill in missing entries so they
+# can't overwrite a newer value set while they were reading the database.
+_pin_msg_ids = SizedDict(size=10_000)
+_pin_msg_ids_lock = threading.Lock()
 
 
 def alert_missing_pins(f):
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         try:
-            f(*args, **kwargs)
+            result = f(*args, **kwargs)
         except mysql.connector.Error as e:
             if e.errno == errorcode.ER_NO_SUCH_TABLE:
                 raise UserFeedbackError('Run `admin init guild` to enable '
                                         'pins')
             raise e
-        return f(*args, **kwargs)
+        return result
     return wrapped
 
 
-# noinspection SqlResolve
-@alert_missing_pins
-@supply_cursor()
-def pin_message(guild_id: int, original_msg_id: int, pin_msg_id: int,
-                cur: MySQLCursor = None):
+def pin_message(guild_id: int, original_msg_id: int, pin_msg_id: int):
     """
     Add a mapping between an original message and Hawkbot's pin message sent
     in a guild's designated pins channel
@@ -37,18 +42,23 @@ def pin_message(guild_id: int, original_msg_id: int, pin_msg_id: int,
     :param pin_msg_id: the id of the pin message Hawkbot sent linking to the
         original
     """
+    _pin_message(guild_id, original_msg_id, pin_msg_id)
+    with _pin_msg_ids_lock:
+        _pin_msg_ids[guild_id, original_msg_id] = pin_msg_id
+
+
+# noinspection SqlResolve
+@alert_missing_pins
+@supply_cursor()
+def _pin_message(guild_id: int, original_msg_id: int, pin_msg_id: int,
+                 cur: MySQLCursor = None):
     typecheck(guild_id, int, 'guild_id')
     cur.execute(f'''
         INSERT INTO g{guild_id}_pins (original, pin) VALUES (%s,%s) 
     ''', (original_msg_id, pin_msg_id))
-    cnx.commit()
 
 
-# noinspection SqlResolve
-@alert_missing_pins
-@supply_cursor()
-def unpin_message(guild_id: int, original_msg_id: int,
-                  cur: MySQLCursor = None) -> Optional[int]:
+def unpin_message(guild_id: int, original_msg_id: int) -> Optional[int]:
     """
     Remove a mapping between an original message and Hawkbot's pin message sent
     in a guild's designated pins channel
@@ -58,22 +68,29 @@ def unpin_message(guild_id: int, original_msg_id: int,
     :return: the id of the pin message Hawkbot sent linking to the original, or
         None if the original message was not found
     """
+    pin_msg_id = _unpin_message(guild_id, original_msg_id)
+    if pin_msg_id:
+        with _pin_msg_ids_lock:
+            _pin_msg_ids[guild_id, original_msg_id] = None
+    return pin_msg_id
+
+
+# noinspection SqlResolve
+@alert_missing_pins
+@supply_cursor()
+def _unpin_message(guild_id: int, original_msg_id: int,
+                   cur: MySQLCursor = None) -> Optional[int]:
     typecheck(guild_id, int, 'guild_id')
     pin_msg_id = get_pin_msg_id(guild_id, original_msg_id)
     if pin_msg_id:
         cur.execute(f'''
             DELETE FROM g{guild_id}_pins WHERE original = %s
         ''', (original_msg_id,))
-        cnx.commit()
         return pin_msg_id
     return None
 
 
-# noinspection SqlResolve
-@alert_missing_pins
-@supply_cursor()
-def get_pin_msg_id(guild_id: int, original_msg_id: int,
-                   cur: MySQLCursor = None) -> Optional[int]:
+def get_pin_msg_id(guild_id: int, original_msg_id: int) -> Optional[int]:
     """
     Get the id of the associated pin message Hawkbot sent in a guild's
     designated pins channel
@@ -83,6 +100,21 @@ def get_pin_msg_id(guild_id: int, original_msg_id: int,
     :return: the id of the pin message Hawkbot sent linking to the original, or
         None if the original message was not found
     """
+    key = (guild_id, original_msg_id)
+    with _pin_msg_ids_lock:
+        if key in _pin_msg_ids:
+            return _pin_msg_ids[key]
+    pin_msg_id = _get_pin_msg_id(guild_id, original_msg_id)
+    with _pin_msg_ids_lock:
+        # Keep the value if a pin or unpin set one while the database was read
+        return _pin_msg_ids.setdefault(key, pin_msg_id)
+
+
+# noinspection SqlResolve
+@alert_missing_pins
+@supply_cursor()
+def _get_pin_msg_id(guild_id: int, original_msg_id: int,
+                    cur: MySQLCursor = None) -> Optional[int]:
     typecheck(guild_id, int, 'guild_id')
     cur.execute(f'''
         SELECT pin FROM g{guild_id}_pins WHERE original = %s
@@ -1,15 +1,19 @@
+from collections import Counter
 import functools
 import logging
+import sys
 from typing import Optional, List, Tuple, Iterator
 
 import mysql.connector
 from mysql.connector import errorcode
 from mysql.connector.cursor import MySQLCursor
 import spacy
+from spacy.tokens import Doc
 
 from utils.errors import typecheck, UserFeedbackError
-from utils.database.misc import flat_pruned_list
-from utils.database.main import cnx, supply_cursor
+from utils.database.misc import batched, batched_fetch, flat_pruned_list, \
+    INSERT_BATCH_SIZE
+from utils.database.main import supply_cursor
 
 logger = logging.getLogger(__name__)
 try:
@@ -22,10 +26,11 @@ except OSError:
 def _create_where_statement(users: int = 0,
                             channels: int = 0,
                             tag: bool = False):
-    users = int(users)
-    channels = int(channels)
-    tag = bool(tag)
+    return _where_statement(int(users), int(channels), bool(tag))
 
+
+@functools.lru_cache(maxsize=64)
+def _where_statement(users: int, channels: int, tag: bool):
     where = ' AND '.join([i for i in [
         users and f'user IN (SELECT key_id FROM users '
                   f'WHERE id IN ({",".join(["%s"] * users)}))',
@@ -40,59 +45,70 @@ def alert_missing_pos_tags(f):
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         try:
-            f(*args, **kwargs)
+            result = f(*args, **kwargs)
         except mysql.connector.Error as e:
             if e.errno == errorcode.ER_NO_SUCH_TABLE:
                 raise UserFeedbackError('No part of speech data generated '
                                         'for this server')
             raise e
-        return f(*args, **kwargs)
+        return result
     return wrapped
 
 
-# noinspection SqlResolve
-@alert_missing_pos_tags
-@supply_cursor()
-def _insert_word(guild_id: int, user: int, channel: int, tag: str,
-                 word: str, cur: MySQLCursor = None):
-    cur.execute(f'''
-        INSERT INTO g{guild_id}_pos_tags
-        (user, channel, tag, word)
-        VALUES (
-            (SELECT key_id FROM users WHERE id=%s),
-            (SELECT key_id FROM channels WHERE id=%s),
-            %s,%s
-        ) ON DUPLICATE KEY UPDATE use_count = use_count + 1
-    ''', (user, channel, tag, word))
-    cnx.commit()
-
-
-def _get_tags(msg: str) -> Iterator[Tuple[str, str]]:
-    try:
-        doc = nlp(msg)
-    except TypeError:
-        return
+def _get_tags(doc: Doc) -> Iterator[Tuple[str, str]]:
     for token in doc:
-        yield token.tag_, token.text
+        # There are only a few dozen tags, so share one string per tag
+        yield sys.intern(token.tag_), token.text
 
 
 # noinspection SqlResolve
 @alert_missing_pos_tags
-@supply_cursor()
-def generate_tags(guild_id: int, cur: MySQLCursor = None):
+@supply_cursor(buffered=False)
+def generate_tags(guild_id: int, n_process: int = 1,
+                  cur: MySQLCursor = None):
+    """
+    Tally the part of speech tags of every word in a guild's messages
+
+    :param guild_id: guild id
+    :param n_process: number of processes spaCy tags with. spaCy forks the
+        workers, which isn't safe in a process with other threads and open
+        connections (like the bot), so only raise this when running on its
+        own.
+    """
     typecheck(guild_id, int, 'guild_id')
     logger.info(f'Generating part of speech tags for server {guild_id}')
 
+    # User and channel are the key ids from the users/channels tables, so the
+    # rows can be inserted as-is
     cur.execute(f'''
-        SELECT users.id, channels.id, content FROM g{guild_id}_messages AS msgs
-        INNER JOIN users ON (msgs.user = users.key_id)
-        INNER JOIN channels ON (msgs.channel = channels.key_id)
+        SELECT user, channel, content FROM g{guild_id}_messages
         WHERE content <> ''
     ''')
 
-    for user_id, channel_id, content in cur:
-        for tag, word in _get_tags(content):
-            _insert_word(guild_id, user_id, channel_id, tag, word)
+    # The scan is streamed, so the connection can't insert until every row
+    # has been read. Tally each (user, channel, tag, word) in the meantime.
+    counts = Counter()
+    docs = nlp.pipe(
+        ((content, (user, channel))
+         for user, channel, content in batched_fetch(cur)
+         if isinstance(content, str)),
+        as_tuples=True, batch_size=256, n_process=n_process
+    )
+    for doc, (user, channel) in docs:
+        for tag, word in _get_tags(doc):
+            counts[user, channel, tag, word] += 1
+
+    rows = (
+        (user, channel, tag, word, count)
+        for (user, channel, tag, word), count in counts.items()
+    )
+    for batch in batched(rows, INSERT_BATCH_SIZE):
+        cur.executemany(f'''
+            INSERT INTO g{guild_id}_pos_tags
+            (user, channel, tag, word, use_count)
+            VALUES (%s,%s,%s,%s,%s)
+            ON DUPLICATE KEY UPDATE use_count = use_count + VALUES(use_count)
+        ''', batch)
 
 
 # noinspection SqlResolve
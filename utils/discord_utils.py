@@ -1,29 +1,66 @@
 import asyncio
 import discord
+import logging
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from utils.errors import UserFeedbackError, ErrorStrings
-from utils.misc import data_folder_path
+from utils.misc import data_folder_path, SizedDict
+
+logger = logging.getLogger(__name__)
+AUDIO_FOLDER = data_folder_path / 'audio'
+# Audio files by their lowercased path relative to AUDIO_FOLDER, so playing a
+# sound doesn't need to check the filesystem. Lookups ignore case, like they
+# did on case-insensitive filesystems before the index.
+_audio_index: Dict[str, Path] = {}
+# Non-bot members by guild id. discord.py updates member objects in place,
+# but joins and leaves, and reconnects (which rebuild every guild and member
+# object), make this stale. See invalidate_guild and invalidate_all.
+_non_bot_users = SizedDict(size=64)
 
 
 async def close_voice(voice):
-    await asyncio.sleep(0.5)
     await voice.disconnect(force=True)
 
 
+def _log_close_voice_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error('Failed to disconnect from voice',
+                     exc_info=task.exception())
+
+
 def get_close_voice_fn(vc):
+    def schedule_close():
+        task = vc.loop.create_task(close_voice(vc))
+        # Nothing awaits the task, so its errors have to be logged here
+        task.add_done_callback(_log_close_voice_error)
+
     def after(error):
-        coro = close_voice(vc)
-        fut = asyncio.run_coroutine_threadsafe(coro, vc.loop)
-        try:
-            fut.result()
-        except Exception:
-            # an error happened sending the message
-            print(f'Exception in get_close_voice_fn: {error}')
+        if error:
+            logger.error(f'Error while playing audio: {error}')
+        # This runs in the audio player's thread; schedule the disconnect on
+        # the event loop rather than blocking the thread until it's done
+        vc.loop.call_soon_threadsafe(schedule_close)
     return after
 
 
+def _audio_key(path: Union[Path, str]) -> str:
+    return Path(path).as_posix().lower()
+
+
+def refresh_audio_index():
+    """Re-scan the audio folder. Call this after adding or removing files."""
+    _audio_index.clear()
+    if AUDIO_FOLDER.is_dir():
+        _audio_index.update(
+            (_audio_key(f.relative_to(AUDIO_FOLDER)), f)
+            for f in AUDIO_FOLDER.rglob('*') if f.is_file()
+        )
+
+
+refresh_audio_index()
+
+
 async def play_audio_file(msg: Optional[discord.Message] = None,
                           path: Union[Path, str] = '',
                           voice_channel: Optional[discord.VoiceChannel] = None):
@@ -31,18 +68,24 @@ async def play_audio_file(msg: Optional[discord.Message] = None,
         # Don't play anything if it's already in a channel
         return
     volume = 0.1
-    path = data_folder_path / 'audio' / path
-    if not path.exists():
-        raise ValueError(f'File does not exist: {path}')
+    file = _audio_index.get(_audio_key(path))
+    if file is None:
+        raise ValueError(f'File does not exist: {AUDIO_FOLDER / path}')
     if not voice_channel:
         voice_channel = get_voice(msg.author)
 
     if voice_channel:
         vc = await voice_channel.connect()
         after = get_close_voice_fn(vc)
-        src = discord.FFmpegPCMAudio(str(path), options='-v error')
-        src = discord.PCMVolumeTransformer(src, volume=volume)
-        await asyncio.sleep(0.5)
+        # Let ffmpeg scale the volume instead of doing it per frame in Python
+        src = discord.FFmpegPCMAudio(
+            str(file), options=f'-v error -af volume={volume}')
+        # Wait until the connection is ready instead of a fixed delay,
+        # backing off up to about half a second
+        delay = 0.01
+        while not vc.is_connected() and delay < 0.5:
+            await asyncio.sleep(delay)
+            delay *= 2
         vc.play(src, after=after)
 
 
@@ -51,8 +94,10 @@ def get_message_url(guild_id: int, channel_id: int, message_id: int):
            f'{guild_id}/{channel_id}/{message_id}'
 
 
-def get_non_bot_users(guild: discord.Guild):
-    return list(filter(lambda u: not u.bot, guild.members))
+def get_non_bot_users(guild: discord.Guild) -> List[discord.Member]:
+    if guild.id not in _non_bot_users:
+        _non_bot_users[guild.id] = [u for u in guild.members if not u.bot]
+    return _non_bot_users[guild.id]
 
 
 def get_text_channels(client: discord.Client, guild_id: int,
@@ -61,7 +106,7 @@ def get_text_channels(client: discord.Client, guild_id: int,
     guild = client.get_guild(guild_id)
     if channel_id:
         return [guild.get_channel(channel_id)]
-    return [g for g in guild.channels if isinstance(g, discord.TextChannel)]
+    return list(guild.text_channels)
 
 
 def get_voice(member):
@@ -69,25 +114,43 @@ def get_voice(member):
         return member.voice.channel
 
 
+def invalidate_all():
+    """Drop cached data for every guild. Call this when the client is ready."""
+    _non_bot_users.clear()
+
+
+def invalidate_guild(guild_id: int):
+    """
+    Drop cached data for a guild. Call this when members join or leave, or
+    the guild becomes available again.
+    """
+    _non_bot_users.pop(guild_id, None)
+
+
 def resolve_channel(guild: discord.Guild,
                     channel_names: List[str]) -> List[discord.TextChannel]:
-    channels = []
+    # Keyed by channel so a channel matched by several names is only
+    # returned once, in the order it was first matched
+    channels = {}
+    # text_channels builds a sorted list on every access, so only get it once
+    text_channels = [(channel.name.lower(), channel)
+                     for channel in guild.text_channels]
     for name in channel_names:
         name = name.lower()
-        for channel in guild.text_channels:
-            if name in channel.name:
-                channels.append(channel)
-    return channels
+        channels.update((channel, None) for lowered, channel in text_channels
+                        if name in lowered)
+    return list(channels)
 
 
 def resolve_users(guild: discord.Guild,
                   user_names: List[str]) -> List[discord.User]:
     users = []
+    # Lowercase each member's name once rather than once per queried name
+    members = [(user.name.lower(), user) for user in guild.members
+               if not user.bot]
     for name in user_names:
         name = name.lower()
-        for user in guild.members:
-            if not user.bot and name in user.name.lower():
-                users.append(user)
+        users.extend(user for lowered, user in members if name in lowered)
     return users
 
 
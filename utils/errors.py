@@ -19,17 +19,23 @@ class ErrorStrings:
     no_pins_channel = 'No pins channel is set for this guild.'
     default = 'An error has occurred.'
 
+    # Subclasses must come before their base classes
     _error_map = {
         discord.errors.Forbidden: 'Missing permissions to get message.',
-        discord.errors.HTTPException: 'HTTP request failed; try again.',
         discord.errors.NotFound: 'Message could not be found.',
+        discord.errors.HTTPException: 'HTTP request failed; try again.',
     }
 
     @classmethod
     def translate(cls, exception: Exception):
-        if exception in cls._error_map:
-            # noinspection PyTypeChecker
-            return cls._error_map[exception]
+        # The map is keyed by type, so look up the exception's type rather
+        # than the exception itself
+        message = cls._error_map.get(type(exception))
+        if message is not None:
+            return message
+        for error_type, message in cls._error_map.items():
+            if isinstance(exception, error_type):
+                return message
         return cls.default
 
 
@@ -1,45 +1,127 @@
-from collections import deque
-from colormath.color_objects import LCHabColor, sRGBColor
-from colormath.color_conversions import convert_color
+from collections import deque, OrderedDict
+from itertools import chain, islice
 from pathlib import Path
 import pkgutil
-from queue import Queue
 import mmh3
+import numpy as np
 import random
 import re
+from stat import S_ISREG
 import sys
 from types import ModuleType, FunctionType
-from typing import Optional, List, Sized, Iterator, Dict, Iterable, Union, Any
+from typing import Optional, List, Sized, Iterator, Dict, Iterable, Union, \
+    Any, Sequence, Tuple
 
 data_folder_path = Path(__file__, '../../data').resolve()
 
-
-class SizedDict(dict):
+_GDRIVE_RE = re.compile(
+    r'https://drive\.google\.com/(?:file/d/|open\?id=)([^/]+).*')
+_NORMALIZE_MAP = str.maketrans({'“': '"', '”': '"'})
+
+# Constants for converting LCh colors to sRGB, matching colormath
+_CIE_E = 216 / 24389
+_D50_WHITE = np.array((0.96422, 1.0, 0.82521))
+_D65_WHITE = np.array((0.95047, 1.0, 1.08883))
+_BRADFORD = np.array((
+    (0.8951, 0.2664, -0.1614),
+    (-0.7502, 1.7135, 0.0367),
+    (0.0389, -0.0685, 1.0296)
+))
+_XYZ_D65_TO_LINEAR_SRGB = np.array((
+    (3.24071, -1.53726, -0.498571),
+    (-0.969258, 1.87599, 0.0415557),
+    (0.0556352, -0.203996, 1.05707)
+))
+# Bradford chromatic adaptation from D50 to sRGB's D65 white point, followed
+# by the sRGB matrix
+_XYZ_D50_TO_LINEAR_SRGB = _XYZ_D65_TO_LINEAR_SRGB @ (
+    np.linalg.pinv(_BRADFORD)
+    @ np.diag((_BRADFORD @ _D65_WHITE) / (_BRADFORD @ _D50_WHITE))
+    @ _BRADFORD
+)
+
+
+class SizedDict(OrderedDict):
+    """
+    A dict which holds at most `size` items. Once it's full, adding an item
+    evicts the least recently used one. Reading an item with [] moves it to
+    the end, so don't do that while iterating.
+    """
 
     def __init__(self, *args, size=10, **kwargs):
+        # Set before initializing since the initial items go through
+        # __setitem__
+        self._size = size
         super(SizedDict, self).__init__(*args, **kwargs)
-        self._key_queue = Queue(size)
+
+    def __getitem__(self, key):
+        value = super(SizedDict, self).__getitem__(key)
+        self.move_to_end(key)
+        return value
 
     def __setitem__(self, key, value):
-        if self._key_queue.full():
-            remove_key = self._key_queue.get()
-            del self[remove_key]
-        self._key_queue.put(key)
         super(SizedDict, self).__setitem__(key, value)
-
-
-def color_from_hash(key):
-    key = str(key)
-    l = (mmh3.hash(key + key[::-1]) + 2147483648) / 4294967296
-    c = (mmh3.hash(key[::-1] + key) + 2147483648) / 4294967296
-    h = (mmh3.hash(key) + 2147483648) / 4294967296
+        self.move_to_end(key)
+        if len(self) > self._size:
+            self.popitem(last=False)
+
+    def copy(self):
+        # OrderedDict.copy reads each item with [], which would reorder this
+        # dict while it's being iterated
+        return type(self)(list(self.items()), size=self._size)
+
+
+def colors_from_hashes(keys: Iterable) -> List[Tuple[float, float, float]]:
+    """
+    Get a color for each key, computing all of them in a single pass
+
+    :param keys: keys to hash. Each is converted to a string first.
+    """
+    # Not cached: a plot's worth of users takes tens of microseconds, which is
+    # nothing next to drawing the plot
+    # Take l, c, and h from separate 32 bit lanes of a single hash
+    lanes = []
+    for key in keys:
+        hash_ = mmh3.hash128(str(key), signed=False)
+        lanes.append((hash_ & 0xFFFFFFFF,
+                      hash_ >> 32 & 0xFFFFFFFF,
+                      hash_ >> 64 & 0xFFFFFFFF))
+    if not lanes:
+        return []
+    l, c, h = np.array(lanes, dtype=np.float64).T / 4294967296
     l = (l*0.6 + 0.3) * 100
     c = (c*0.75 + 0.25) * 100
     h = h * 360
 
-    lch = LCHabColor(l, c, h)
-    rgb: sRGBColor = convert_color(lch, sRGBColor)
-    return rgb.clamped_rgb_r, rgb.clamped_rgb_g, rgb.clamped_rgb_b
+    return [tuple(rgb) for rgb in _lch_to_srgb(l, c, h).tolist()]
+
+
+def _lch_to_srgb(l: np.ndarray, c: np.ndarray, h: np.ndarray) -> np.ndarray:
+    """
+    Convert CIE LCh(ab) colors (D50, 2° observer) to sRGB, clamped to [0, 1]
+
+    :param l: 1D array of lightnesses in [0, 100]
+    :param c: 1D array of chromas
+    :param h: 1D array of hues in degrees
+    :return: an (N, 3) array of sRGB colors
+    """
+    # LCh -> Lab
+    h = np.radians(h)
+    a = c * np.cos(h)
+    b = c * np.sin(h)
+
+    # Lab -> XYZ, one column per color
+    fy = (l + 16) / 116
+    f = np.stack((a / 500 + fy, fy, fy - b / 200))
+    xyz = np.where(f ** 3 > _CIE_E, f ** 3, (f - 16 / 116) / 7.787)
+    xyz *= _D50_WHITE[:, np.newaxis]
+
+    # XYZ -> linear sRGB -> sRGB
+    rgb = _XYZ_D50_TO_LINEAR_SRGB @ xyz
+    rgb = np.where(rgb <= 0.0031308,
+                   rgb * 12.92,
+                   1.055 * np.abs(rgb) ** (1 / 2.4) - 0.055)
+    return np.clip(rgb, 0, 1).T
 
 
 # noinspection PyShadowingBuiltins
@@ -57,8 +139,7 @@ def find_submodules(globals: Dict[str, Any], path: str):
 
 
 def gdrive_direct_link(url: str) -> Optional[str]:
-    match = re.match(
-        r'https://drive\.google\.com/(?:file/d/|open\?id=)([^/]+).*', url)
+    match = _GDRIVE_RE.match(url)
     if match:
         return ('https://drive.google.com/uc?export=download&id='
                 + match.group(1))
@@ -69,16 +150,15 @@ def merge_names(names: List[str]):
     if len(names) == 1:
         return names[0]
     out = ''
-    for i in range(min(len(names), 5)):
-        n = random.choice(names)
-        names.remove(n)
-
+    # Pick without replacement and without modifying the caller's list
+    picks = random.sample(names, k=min(len(names), 5))
+    for i, n in enumerate(picks):
         if len(n) > 3:
             rand_length = random.randrange(len(n) // 3,
                                            2 * len(n) // 3)
             if i == 0:
                 offset = 0
-            elif i == len(names) - 1:
+            elif i == len(picks) - 1:
                 offset = len(n) - rand_length
             else:
                 offset = random.randrange(1, len(n) - 1 - rand_length)
@@ -89,13 +169,18 @@ def merge_names(names: List[str]):
 
 
 def normalize_text(text):
-    return text.replace('“', '"').replace('”', '"')
+    return text.translate(_NORMALIZE_MAP)
 
 
 def random_by_filesize(files: List[Path]) -> Path:
-    if not all([f.is_file() for f in files]):
+    try:
+        stats = [f.stat() for f in files]
+    except (FileNotFoundError, NotADirectoryError):
+        # Path.is_file, which this replaced, treats these as "not a file"
+        raise ValueError('One or more paths is not a file')
+    if not all(S_ISREG(s.st_mode) for s in stats):
         raise ValueError('One or more paths is not a file')
-    file_sizes = [f.stat().st_size for f in files]  # Sizes in bytes
+    file_sizes = [s.st_size for s in stats]  # Sizes in bytes
     return random.choices(files, weights=file_sizes)[0]
 
 
@@ -104,6 +189,10 @@ def random_color():
 
 
 def random_offset_iter(it: Union[Iterable, Sized]) -> Iterator:
-    d = deque(it)
-    d.rotate(random.randint(0, len(it)-1))
-    return d
+    if not isinstance(it, Sequence):
+        d = deque(it)
+        d.rotate(random.randint(0, len(it)-1))
+        return iter(d)
+    # Start partway through the sequence and wrap around without copying it
+    offset = random.randint(0, len(it)-1)
+    return chain(islice(it, offset, None), islice(it, offset))
@@ -1,42 +1,75 @@
+from collections import namedtuple
 from io import BytesIO
+from typing import List
 
 import matplotlib
 import numpy as np
 
 matplotlib.use('agg')
 
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 # import matplotlib.style as mplstyle
 # mplstyle.use('dark_background')
 
-from utils.misc import color_from_hash
+from PIL import Image
+
+from utils.misc import colors_from_hashes
 
 # plt.rc('font', size=20, family='Calibri')
 
 # https://stackoverflow.com/questions/14313510/how-to-calculate-moving-average-using-numpy
 
+# A figure with a single axes, plus the month locator and formatter for its x
+# axis. Each figure has its own since setting them on an axis binds them to
+# it, and plots may be drawn in several threads at once.
+_PooledFigure = namedtuple('_PooledFigure', 'fig locator formatter')
+
+# Figures are reused between plots since creating them is slow
+_figure_pool: List[_PooledFigure] = []
+
 
 class CountPlotData:
+    """
+    Daily message counts per user. Each user's dates and counts are kept in
+    their own arrays, which double in size when they fill up.
+    """
 
-    # data_dtype = np.dtype('M8[D], u4')
-    data_dtype = np.dtype([('date', 'M8[D]'), ('count', 'u4')])
+    initial_capacity = 16
 
     def __init__(self):
         self.data = {}
 
     def init_id(self, id_: int, name: str):
         if id_ not in self.data:
-            self.data[id_] = {'name': name, 'counts': []}
+            self.data[id_] = {
+                'name': name,
+                'dates': np.empty(self.initial_capacity, 'M8[D]'),
+                'counts': np.empty(self.initial_capacity, 'u4'),
+                'n': 0
+            }
 
     def add(self, id_, name, date, count):
         self.init_id(id_, name)
-        self.data[id_]['counts'].append((date, count))
+        data = self.data[id_]
+        n = data['n']
+        if n == len(data['dates']):
+            data['dates'] = np.resize(data['dates'], 2 * n)
+            data['counts'] = np.resize(data['counts'], 2 * n)
+        data['dates'][n] = date
+        data['counts'][n] = count
+        data['n'] = n + 1
 
     def get_counts(self):
+        """
+        :return: an iterator of (name, dates, cumulative counts) for each user
+        """
         for data in self.data.values():
-            yield (data['name'],
-                   np.fromiter(data['counts'], dtype=self.data_dtype))
+            n = data['n']
+            yield (data['name'], data['dates'][:n],
+                   np.cumsum(data['counts'][:n]))
 
 
 class GridShader:
@@ -75,31 +108,61 @@ class GridShader:
             self.spans.append(self.ax.axvspan(s, e, zorder=0, **self.kw))
 
 
+def _acquire_figure() -> _PooledFigure:
+    """Get a figure with a single, empty axes from the pool"""
+    try:
+        return _figure_pool.pop()
+    except IndexError:
+        # Created without pyplot so pooled figures aren't tracked as open
+        fig = Figure(figsize=(16, 9), dpi=125)
+        FigureCanvasAgg(fig)
+        fig.subplots()
+        return _PooledFigure(fig, mdates.MonthLocator(),
+                             mdates.DateFormatter('%Y-%m'))
+
+
+def _release_figure(pooled: _PooledFigure):
+    for ax in pooled.fig.axes:
+        ax.cla()
+    _figure_pool.append(pooled)
+
+
 def figure_to_image_stream(fig: plt.Figure):
+    # Encode with a low compression level; the image is uploaded once, so a
+    # slightly bigger file is cheaper than the time spent compressing it
+    fig.canvas.draw()
     img = BytesIO()
-    fig.savefig(img, format='png')
+    Image.fromarray(np.asarray(fig.canvas.buffer_rgba())).save(
+        img, format='png', compress_level=1)
     img.seek(0)
     return img
 
 
 def plot_counts(data: CountPlotData, pattern: str):
-    # Create fig
-    fig, ax = plt.subplots(figsize=(16, 9), dpi=125)
+    pooled = _acquire_figure()
+    try:
+        return _plot_counts(pooled, data, pattern)
+    finally:
+        _release_figure(pooled)
+
+
+def _plot_counts(pooled: _PooledFigure, data: CountPlotData, pattern: str):
+    fig = pooled.fig
+    ax = fig.axes[0]
 
     fig.autofmt_xdate()
-    locator = mdates.MonthLocator()
-    formatter = mdates.DateFormatter('%Y-%m')
-    ax.xaxis.set_major_locator(locator)
-    ax.xaxis.set_major_formatter(formatter)
+    ax.xaxis.set_major_locator(pooled.locator)
+    ax.xaxis.set_major_formatter(pooled.formatter)
     ax.grid()
 
-    for name, counts in data.get_counts():
+    user_counts = list(data.get_counts())
+    colors = colors_from_hashes(name for name, _, _ in user_counts)
+    for (name, dates, counts), color in zip(user_counts, colors):
         # Run for every user
-        counts['count'] = np.cumsum(counts['count'])
-        ax.plot(counts['date'], counts['count'],
+        ax.plot(dates, counts,
                 label=name, linewidth=3,
-                marker='o' if len(counts['date']) else '',
-                color=color_from_hash(name))
+                marker='o' if len(dates) else '',
+                color=color)
 
     ax.set_title(f'Stats for {pattern}', fontsize=20)
     ax.set_xlabel('Month', fontsize=20)
@@ -111,6 +174,4 @@ def plot_counts(data: CountPlotData, pattern: str):
     ax.legend(loc='best', fontsize='x-large')
     GridShader(ax, facecolor="lightgrey", alpha=0.5)
 
-    image = figure_to_image_stream(fig)
-    plt.close(fig)
-    return image
+    return figure_to_image_stream(fig)
@@ -0,0 +1,135 @@
+import discord.errors
+import numpy as np
+import pytest
+
+from utils.database.messages import _create_where_statement, \
+    _word_limit_re
+from utils.errors import ErrorStrings
+from utils.misc import _lch_to_srgb, colors_from_hashes, SizedDict
+
+
+class TestSizedDict:
+
+    def test_eviction(self):
+        d = SizedDict(size=2)
+        d[1] = 'a'
+        d[2] = 'b'
+        d[3] = 'c'
+        assert list(d.items()) == [(2, 'b'), (3, 'c')]
+
+    def test_lru_order(self):
+        d = SizedDict(size=2)
+        d[1] = 'a'
+        d[2] = 'b'
+        # Reading 1 makes 2 the least recently used
+        assert d[1] == 'a'
+        d[3] = 'c'
+        assert list(d) == [1, 3]
+
+        # So does setting it again
+        d[1] = 'A'
+        d[4] = 'd'
+        assert list(d.items()) == [(1, 'A'), (4, 'd')]
+
+    def test_init(self):
+        d = SizedDict([(1, 'a'), (2, 'b'), (3, 'c')], size=2)
+        assert list(d) == [2, 3]
+
+    def test_copy(self):
+        d = SizedDict(size=2)
+        d[1] = 'a'
+        d[2] = 'b'
+        copy = d.copy()
+        assert list(copy.items()) == [(1, 'a'), (2, 'b')]
+        assert list(d.items()) == [(1, 'a'), (2, 'b')]
+        copy[3] = 'c'
+        assert list(copy) == [2, 3]
+
+
+class TestLchToSrgb:
+
+    # Reference colors from colormath's LCHabColor -> sRGBColor conversion,
+    # clamped
+    colors = [
+        ((50, 40, 200), (0.0, 0.5335758754775801, 0.5529745417810634)),
+        ((75, 60, 30), (1.0, 0.5567508213807705, 0.521258922590434)),
+        ((30, 80, 300),
+         (0.27208459082550407, 0.1851749352757234, 0.71437319037761)),
+        ((90, 10, 120),
+         (0.8703915310920869, 0.8980462985431781, 0.8217211113267225)),
+        ((100, 0, 0), (1.0, 0.9999940399170156, 0.9999354297584101)),
+    ]
+
+    def test_colormath_reference(self):
+        l, c, h = np.array([lch for lch, _ in self.colors], dtype=float).T
+        rgb = _lch_to_srgb(l, c, h)
+        assert rgb.shape == (len(self.colors), 3)
+        for actual, (_, expected) in zip(rgb, self.colors):
+            assert tuple(actual) == pytest.approx(expected, abs=1e-9)
+
+    def test_colors_from_hashes(self):
+        # The color the colormath conversion gave this name
+        assert colors_from_hashes(['alice']) == [
+            pytest.approx((1.0, 0.7746672390244308, 0.4954063975174174),
+                          abs=1e-9)
+        ]
+        # Keys are hashed as strings
+        assert colors_from_hashes([123]) == colors_from_hashes(['123'])
+        assert colors_from_hashes([]) == []
+
+
+class TestErrorStrings:
+
+    @staticmethod
+    def make_error(error_type):
+        # HTTPException's constructor needs a response, which the
+        # translation doesn't use
+        return error_type.__new__(error_type)
+
+    def test_exact_type(self):
+        for error_type, message in ErrorStrings._error_map.items():
+            error = self.make_error(error_type)
+            assert ErrorStrings.translate(error) == message
+
+    def test_subclass(self):
+        class CustomNotFound(discord.errors.NotFound):
+            pass
+
+        assert ErrorStrings.translate(self.make_error(CustomNotFound)) \
+            == ErrorStrings._error_map[discord.errors.NotFound]
+
+    def test_unknown(self):
+        assert ErrorStrings.translate(ValueError()) == ErrorStrings.default
+
+
+class TestWordLimitRe:
+
+    def test_min_and_max(self):
+        pattern = _word_limit_re(2, 3)
+        assert not pattern.match('one')
+        assert pattern.match('one two')
+        assert pattern.match('one  two three')
+        assert not pattern.match('one two three four')
+
+    def test_open_ended(self):
+        assert _word_limit_re(None, 2).match('one')
+        assert not _word_limit_re(None, 2).match('one two three')
+        assert not _word_limit_re(3, None).match('one two')
+        assert _word_limit_re(3, None).match('one two three four five')
+
+    def test_whole_message(self):
+        pattern = _word_limit_re(1, 2)
+        assert not pattern.match('')
+        assert not pattern.match(' one')
+        assert not pattern.match('one ')
+
+    def test_runs_of_spaces(self):
+        # Only words count towards the limit, not the spaces between them
+        assert _word_limit_re(None, 2).match('one  two')
+        assert _word_limit_re(2, 2).match('one   two')
+
+    def test_sql_only_bounds_minimum(self):
+        # word_count counts spaces, so "one  two" has a word_count of 3.
+        # Bounding the maximum in SQL would wrongly exclude it.
+        assert _create_where_statement(word_count=True) \
+            == 'WHERE word_count >= %s'